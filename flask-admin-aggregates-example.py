@@ -0,0 +1,279 @@
+"""
+flask-admin-aggregates-example.py
+
+Requirements:
+ Click==7.0
+ Flask==1.0.2
+ Flask-Admin==1.5.3
+ Flask-SQLAlchemy==2.3.2
+ itsdangerous==1.1.0
+ Jinja2==2.10
+ MarkupSafe==1.1.0
+ SQLAlchemy==1.2.17
+ Werkzeug==0.14.1
+ WTForms==2.2.1
+
+Usage:
+ - Run script using 'python flask-admin-aggregates-example.py'
+ - Then visit 'http://127.0.0.1:5000/admin' for dashboard and 'http://127.0.0.1:5000/admin/userstats' for per author stats
+ - Create sample data using 'FLASK_APP=flask-admin-aggregates-example.py flask seed-posts --users 1000 --posts 100000'
+ - Recompute all aggregates using 'FLASK_APP=flask-admin-aggregates-example.py flask recompute-user-stats'
+ - Compare dashboard queries with live aggregates using 'FLASK_APP=flask-admin-aggregates-example.py flask bench-dashboard'
+
+Notes:
+    - Showing post count or latest post per user in admin would run 'COUNT'/'MAX' over 'post' for every row.
+    - Here 'user_stats' table keeps 'post_count' and 'last_post_at' per author. It is maintained in same transaction
+      as the change, by sqlalchemy 'after_insert', 'after_update' and 'after_delete' events on 'Post'.
+        - 'post_count' is adjusted by +1/-1.
+        - 'last_post_at' is re-read as 'MAX(date_created)' of that author only, which is an index lookup on
+          '(author_id, date_created)', so deletes and edits stay correct too.
+        - Deleting a user deletes its 'user_stats' row first ('before_delete' on 'User'), so it works with
+          foreign keys enforced.
+    - Dashboard and 'User stats' view only read 'user_stats', so their cost does not depend on number of posts.
+    - Events fire only for ORM unit of work. Bulk writes using core (like 'seed-posts' below) or raw sql bypass
+      them, so run 'recompute-user-stats' after those.
+
+References:
+ - https://flask-admin.readthedocs.io/en/latest/
+ - https://docs.sqlalchemy.org/en/latest/orm/events.html#mapper-events
+"""
+import time
+
+import click
+from flask import Flask
+from flask_admin import Admin, AdminIndexView, expose
+from flask_admin.contrib.sqla import ModelView
+from jinja2 import ChoiceLoader, DictLoader
+from sqlalchemy import event, text
+
+# database setup
+from flask_sqlalchemy import SQLAlchemy
+db = SQLAlchemy()
+
+# database models
+from sqlalchemy.sql import func
+class User(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    date_created = db.Column(db.DateTime, server_default=func.now())
+    date_modified = db.Column(db.DateTime, onupdate=func.now())
+    username = db.Column(db.String(32), nullable=False, unique=True)
+    posts = db.relationship("Post", backref="user", lazy=True)
+
+    def __repr__(self):
+        return "<%s>" % self.username
+
+
+class Post(db.Model):
+    __table_args__ = (db.Index("ix_post_author_id_date_created", "author_id", "date_created"),)
+    id = db.Column(db.Integer, primary_key=True)
+    date_created = db.Column(db.DateTime, server_default=func.now())
+    date_modified = db.Column(db.DateTime, onupdate=func.now())
+    author_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False)
+    title = db.Column(db.String(32), nullable=False)
+    text = db.Column(db.Text)
+
+    def __repr__(self):
+        return "<%s>" % self.title
+
+
+class UserStats(db.Model):
+    """Per author aggregates of 'post'. Maintained by events below, never edited directly"""
+    __tablename__ = "user_stats"
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), primary_key=True)
+    post_count = db.Column(db.Integer, nullable=False, default=0, index=True)
+    last_post_at = db.Column(db.DateTime, index=True)
+    user = db.relationship("User", lazy="joined")
+
+    def __repr__(self):
+        return "<stats %s>" % self.user_id
+
+
+##############
+# aggregates
+##############
+
+def _last_post_at(author_id):
+    return db.select([func.max(Post.date_created)]).where(Post.author_id == author_id).as_scalar()
+
+
+def adjust_user_stats(connection, author_id, delta):
+    """Add delta to author's post count and refresh last post time, in caller's transaction"""
+    stats = UserStats.__table__
+    result = connection.execute(stats.update().where(stats.c.user_id == author_id).values(
+        post_count=stats.c.post_count + delta, last_post_at=_last_post_at(author_id)))
+    if result.rowcount == 0:
+        connection.execute(stats.insert().values(
+            user_id=author_id, post_count=max(delta, 0), last_post_at=_last_post_at(author_id)))
+
+
+@event.listens_for(Post, "after_insert")
+def post_inserted(mapper, connection, target):
+    adjust_user_stats(connection, target.author_id, 1)
+
+
+@event.listens_for(Post, "after_delete")
+def post_deleted(mapper, connection, target):
+    adjust_user_stats(connection, target.author_id, -1)
+
+
+@event.listens_for(Post, "after_update")
+def post_updated(mapper, connection, target):
+    history = db.inspect(target).attrs.author_id.history
+    if history.has_changes():
+        for author_id in history.deleted:
+            adjust_user_stats(connection, author_id, -1)
+        for author_id in history.added:
+            adjust_user_stats(connection, author_id, 1)
+    elif db.inspect(target).attrs.date_created.history.has_changes():
+        adjust_user_stats(connection, target.author_id, 0)
+
+
+@event.listens_for(User, "before_delete")
+def user_deleting(mapper, connection, target):
+    # before user row goes, so foreign key from 'user_stats' is never left dangling
+    connection.execute(UserStats.__table__.delete().where(UserStats.__table__.c.user_id == target.id))
+
+
+def recompute_user_stats():
+    """Rebuild 'user_stats' from 'post' in one transaction"""
+    with db.engine.begin() as connection:
+        connection.execute(UserStats.__table__.delete())
+        connection.execute(text(
+            "INSERT INTO user_stats (user_id, post_count, last_post_at) "
+            "SELECT author_id, COUNT(*), MAX(date_created) FROM post GROUP BY author_id"))
+
+
+############
+# dashboard
+############
+
+templates = {
+    "dashboard.html": """
+{% extends 'admin/master.html' %}
+{% block body %}
+<h3>Dashboard</h3>
+<p>{{ totals.authors }} authors, {{ totals.posts }} posts, last post at {{ totals.last_post_at }}</p>
+<div class="row">
+  <div class="col-md-6">
+    <h4>Top authors</h4>
+    <table class="table table-condensed">
+      <tr><th>User</th><th>Posts</th></tr>
+      {% for stats in top_authors %}<tr><td>{{ stats.user.username }}</td><td>{{ stats.post_count }}</td></tr>{% endfor %}
+    </table>
+  </div>
+  <div class="col-md-6">
+    <h4>Recently active</h4>
+    <table class="table table-condensed">
+      <tr><th>User</th><th>Last post at</th></tr>
+      {% for stats in recently_active %}<tr><td>{{ stats.user.username }}</td><td>{{ stats.last_post_at }}</td></tr>{% endfor %}
+    </table>
+  </div>
+</div>
+{% endblock %}
+"""
+}
+
+
+def dashboard_data(limit=10):
+    """Dashboard numbers, read from 'user_stats' only"""
+    posts, authors, last_post_at = db.session.query(
+        func.coalesce(func.sum(UserStats.post_count), 0), func.count(UserStats.user_id),
+        func.max(UserStats.last_post_at)).one()
+    return {
+        "totals": {"posts": posts, "authors": authors, "last_post_at": last_post_at},
+        "top_authors": UserStats.query.order_by(UserStats.post_count.desc()).limit(limit).all(),
+        "recently_active": UserStats.query.filter(UserStats.last_post_at.isnot(None))
+                                          .order_by(UserStats.last_post_at.desc()).limit(limit).all(),
+    }
+
+
+class DashboardView(AdminIndexView):
+    @expose("/")
+    def index(self):
+        return self.render("dashboard.html", **dashboard_data())
+
+
+class UserStatsView(ModelView):
+    can_create = False
+    can_edit = False
+    can_delete = False
+    column_list = ("user", "post_count", "last_post_at")
+    column_sortable_list = ("post_count", "last_post_at")
+    column_default_sort = ("post_count", True)
+
+
+class Config(object):
+    SQLALCHEMY_DATABASE_URI = "sqlite:///temp.sqlite3"
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+    SECRET_KEY = "<my-secret-key>"
+    FLASK_ADMIN_SWATCH = "cerulean"
+
+
+def create_app():
+    # init flask app
+    app = Flask(__name__)
+    app.config.from_object(Config)
+    app.jinja_loader = ChoiceLoader([DictLoader(templates), app.jinja_loader])
+
+    db.init_app(app)
+
+    with app.app_context():
+        # init admin
+        admin = Admin(app, name="microblog", template_mode="bootstrap3", index_view=DashboardView(name="Dashboard"))
+        admin.add_view(ModelView(User, db.session))
+        admin.add_view(ModelView(Post, db.session))
+        admin.add_view(UserStatsView(UserStats, db.session, name="User stats"))
+
+        # create tables
+        db.create_all()
+
+    @app.cli.command("recompute-user-stats")
+    def recompute_user_stats_command():
+        """Rebuild all per author aggregates from posts"""
+        start = time.time()
+        recompute_user_stats()
+        click.echo("Recomputed stats of %d authors in %.2fs" % (UserStats.query.count(), time.time() - start))
+
+    @app.cli.command("seed-posts")
+    @click.option("--users", default=1000, help="Number of users to create")
+    @click.option("--posts", default=100000, help="Number of posts to create")
+    def seed_posts(users, posts):
+        """Bulk create users and posts, then recompute aggregates"""
+        import random
+        first_id = (db.session.query(func.max(User.id)).scalar() or 0) + 1
+        db.session.execute(User.__table__.insert(), [{"username": "user%d" % i}
+                                                     for i in range(first_id, first_id + users)])
+        for offset in range(0, posts, 10000):
+            db.session.execute(Post.__table__.insert(), [
+                {"author_id": random.randint(first_id, first_id + users - 1), "title": "post %d" % i, "text": "text"}
+                for i in range(offset, min(offset + 10000, posts))])
+        db.session.commit()
+        recompute_user_stats()
+        click.echo("Created %d users and %d posts" % (users, posts))
+
+    @app.cli.command("bench-dashboard")
+    @click.option("--repeat", default=20, help="Number of runs")
+    def bench_dashboard(repeat):
+        """Compare dashboard queries on 'user_stats' with same numbers computed live from 'post'"""
+        def live():
+            db.session.query(func.count(Post.id), func.count(func.distinct(Post.author_id)),
+                             func.max(Post.date_created)).one()
+            db.session.query(Post.author_id, func.count(Post.id)).group_by(Post.author_id) \
+                .order_by(func.count(Post.id).desc()).limit(10).all()
+            db.session.query(Post.author_id, func.max(Post.date_created)).group_by(Post.author_id) \
+                .order_by(func.max(Post.date_created).desc()).limit(10).all()
+
+        click.echo("%d posts, %d authors" % (Post.query.count(), UserStats.query.count()))
+        for name, func_ in (("user_stats", dashboard_data), ("live", live)):
+            start = time.time()
+            for _ in range(repeat):
+                func_()
+                db.session.expunge_all()
+            click.echo("%-12s %8.2f ms/dashboard" % (name, (time.time() - start) / repeat * 1000))
+
+    return app
+
+
+if __name__ == "__main__":
+    app = create_app()
+    app.run()
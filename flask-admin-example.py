@@ -54,12 +54,16 @@ class Post(db.Model):
         return "<%s>" % self.title
 
 
+class Config(object):
+    SQLALCHEMY_DATABASE_URI = "sqlite:///temp.sqlite3"
+    SECRET_KEY = "<my-secret-key>"
+    FLASK_ADMIN_SWATCH = "cerulean"
+
+
 def create_app():
     # init flask app
     app = Flask(__name__)
-    app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///temp.sqlite3"
-    app.config["SECRET_KEY"] = "<my-secret-key>"
-    app.config["FLASK_ADMIN_SWATCH"] = "cerulean"
+    app.config.from_object(Config)
 
     db.init_app(app)
 
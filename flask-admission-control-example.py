@@ -0,0 +1,476 @@
+"""
+flask-admission-control-example.py
+
+Requirements:
+ Babel==2.6.0
+ bcrypt==3.1.6
+ blinker==1.4
+ Click==7.0
+ Flask==1.0.2
+ Flask-Admin==1.5.3
+ Flask-BabelEx==0.9.3
+ Flask-JWT-Extended==3.17.0
+ Flask-Login==0.4.1
+ Flask-Mail==0.9.1
+ Flask-Principal==0.4.0
+ Flask-Security==3.0.0
+ Flask-SQLAlchemy==2.3.2
+ Flask-WTF==0.14.2
+ itsdangerous==1.1.0
+ Jinja2==2.10
+ MarkupSafe==1.1.0
+ passlib==1.7.1
+ PyJWT==1.7.1
+ pytz==2018.9
+ speaklater==1.3
+ SQLAlchemy==1.2.17
+ Werkzeug==0.14.1
+ WTForms==2.2.1
+
+Usage:
+ - Run script using 'python flask-admission-control-example.py'
+ - Visit below urls
+    - cheap routes 'http://127.0.0.1:5000/marketing', 'http://127.0.0.1:5000/home' and 'http://127.0.0.1:5000/api/jwttest'
+    - hashing routes 'http://127.0.0.1:5000/login' and 'http://127.0.0.1:5000/register'
+    - db heavy route 'http://127.0.0.1:5000/admin/user/'
+    - current limits 'http://127.0.0.1:5000/admission'
+ - Run login storm scenario using 'FLASK_APP=flask-admission-control-example.py flask load-test --storm 32 --duration 5'
+   It runs same storm with admission control off and on, and prints '/marketing' latency of both runs.
+
+Notes:
+    - Every request belongs to one cost class ('hashing', 'db' or 'cheap'), looked up by '@cost_class' decorator
+      on view, then endpoint or blueprint name in 'ADMISSION_ROUTES', then 'ADMISSION_DEFAULT_CLASS'.
+    - Each class has its own concurrency limit, so a login storm can only occupy 'limit' workers.
+      Request over limit waits at most 'queue_timeout' seconds for a slot, else it gets '503' with 'Retry-After'.
+    - Limits adapt using AIMD, per class
+        - request finished within 'target_latency' while class was at its limit -> limit += 1 / limit
+        - request slower than 'target_latency' -> limit *= 'backoff' (at most once per 'target_latency')
+    - Priority: 'low' priority classes are admitted only while less than
+      'ADMISSION_WORKERS - ADMISSION_RESERVED_WORKERS' requests are in flight, so some workers always stay free for
+      'high' priority classes. Low priority classes also do not queue (queue_timeout 0), they are shed early.
+    - Admission check is first 'before_request' function, so shed request costs no database query or hashing.
+    - Set 'ADMISSION_WORKERS' to number of server worker threads/processes. Limits are per process.
+
+References:
+ - https://pythonhosted.org/Flask-Security/
+ - https://en.wikipedia.org/wiki/Additive_increase/multiplicative_decrease
+ - https://tools.ietf.org/html/rfc7231#section-7.1.3 (Retry-After)
+"""
+import math
+import threading
+import time
+
+import click
+from flask import Flask, g, jsonify, request
+
+# flask-security
+from flask_security import Security, RoleMixin, UserMixin, login_required, current_user
+security = Security()
+
+# flask-mail
+from flask_mail import Mail
+mail = Mail()
+
+# database setup
+from flask_sqlalchemy import SQLAlchemy
+db = SQLAlchemy()
+
+# flask-jwt-extended setup
+from flask_jwt_extended import JWTManager, jwt_required, create_access_token
+jwt = JWTManager()
+
+
+#####################
+# admission control
+#####################
+
+class CostClass(object):
+    """Concurrency limit of one cost class, adjusted by AIMD on observed latency"""
+
+    def __init__(self, name, limit=4, min_limit=1, max_limit=16, target_latency=0.5, backoff=0.9,
+                 queue_timeout=0, priority="low", retry_after=1):
+        self.name = name
+        self.initial_limit = limit
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.target_latency = target_latency
+        self.backoff = backoff
+        self.queue_timeout = queue_timeout
+        self.priority = priority
+        self.retry_after = retry_after
+        self._cond = threading.Condition()
+        self.reset()
+
+    def reset(self):
+        with self._cond:
+            self.limit = float(self.initial_limit)
+            self.in_flight = 0
+            self.admitted = 0
+            self.shed = 0
+            self.latency = None
+            self._next_decrease = 0
+
+    def acquire(self):
+        deadline = time.time() + self.queue_timeout
+        with self._cond:
+            while self.in_flight >= int(self.limit):
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+            self.in_flight += 1
+            self.admitted += 1
+            return True
+
+    def release(self, latency):
+        with self._cond:
+            saturated = self.in_flight >= int(self.limit)
+            self.in_flight -= 1
+            self.latency = latency if self.latency is None else 0.8 * self.latency + 0.2 * latency
+            now = time.time()
+            if latency > self.target_latency:
+                if now >= self._next_decrease:
+                    self.limit = max(self.min_limit, self.limit * self.backoff)
+                    self._next_decrease = now + self.target_latency
+            elif saturated:
+                self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+            self._cond.notify()
+
+    def stats(self):
+        return {"limit": round(self.limit, 2), "in_flight": self.in_flight, "admitted": self.admitted,
+                "shed": self.shed, "latency": self.latency, "priority": self.priority}
+
+
+def cost_class(name):
+    """Put decorated view in cost class"""
+    def decorator(func):
+        func.cost_class = name
+        return func
+    return decorator
+
+
+class AdmissionControl(object):
+    """Admits or sheds every request based on its cost class"""
+
+    def __init__(self, app=None):
+        self.app = None
+        self.classes = {}
+        self.in_flight = 0
+        self._endpoint_classes = {}
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("ADMISSION_ENABLED", True)
+        app.config.setdefault("ADMISSION_WORKERS", 16)
+        app.config.setdefault("ADMISSION_RESERVED_WORKERS", 4)
+        app.config.setdefault("ADMISSION_CLASSES", {"cheap": {"priority": "high", "limit": 16}})
+        app.config.setdefault("ADMISSION_ROUTES", {})
+        app.config.setdefault("ADMISSION_DEFAULT_CLASS", "cheap")
+        self.app = app
+        self.classes = {name: CostClass(name, **options) for name, options in app.config["ADMISSION_CLASSES"].items()}
+        self._endpoint_classes = {}
+        app.extensions["admission_control"] = self
+        # run before every other before_request function (flask-principal identity loading, flask-login user
+        # loading), so shed request does not touch database
+        app.before_request_funcs.setdefault(None, []).insert(0, self._admit)
+        app.teardown_request(self._release)
+
+    def reset(self):
+        for cls in self.classes.values():
+            cls.reset()
+
+    def class_for(self, endpoint, blueprint):
+        if endpoint not in self._endpoint_classes:
+            routes = self.app.config["ADMISSION_ROUTES"]
+            view = self.app.view_functions.get(endpoint)
+            name = getattr(view, "cost_class", None) or routes.get(endpoint) or routes.get(blueprint) \
+                or self.app.config["ADMISSION_DEFAULT_CLASS"]
+            self._endpoint_classes[endpoint] = self.classes[name]
+        return self._endpoint_classes[endpoint]
+
+    def _admit(self):
+        if not self.app.config["ADMISSION_ENABLED"]:
+            return None
+        cls = self.class_for(request.endpoint, request.blueprint)
+        if cls.priority == "low":
+            low_slots = self.app.config["ADMISSION_WORKERS"] - self.app.config["ADMISSION_RESERVED_WORKERS"]
+            # unlocked read, may admit one request too many under race. It is a soft limit
+            if self.in_flight >= low_slots:
+                return self._shed(cls)
+        if not cls.acquire():
+            return self._shed(cls)
+        with self._lock:
+            self.in_flight += 1
+        g._admission = (cls, time.time())
+        return None
+
+    def _release(self, exc):
+        admission = g.pop("_admission", None)
+        if admission is None:
+            return
+        cls, start = admission
+        with self._lock:
+            self.in_flight -= 1
+        cls.release(time.time() - start)
+
+    def _shed(self, cls):
+        with self._lock:
+            cls.shed += 1
+        response = jsonify({"msg": "Server busy, retry later", "cost_class": cls.name})
+        response.status_code = 503
+        response.headers["Retry-After"] = str(int(math.ceil(max(cls.retry_after, cls.latency or 0))))
+        return response
+
+    def stats(self):
+        return {"enabled": self.app.config["ADMISSION_ENABLED"], "in_flight": self.in_flight,
+                "classes": {name: cls.stats() for name, cls in self.classes.items()}}
+
+
+admission = AdmissionControl()
+
+
+##################
+# database models
+##################
+
+from sqlalchemy.sql import func
+roles_users = db.Table("roles_users",
+                       db.Column("user_id", db.Integer(), db.ForeignKey("user.id")),
+                       db.Column("role_id", db.Integer(), db.ForeignKey("role.id")))
+
+
+class Role(db.Model, RoleMixin):
+    id = db.Column(db.Integer, primary_key=True)
+    date_created = db.Column(db.DateTime, server_default=func.now())
+    date_modified = db.Column(db.DateTime, onupdate=func.now())
+    name = db.Column(db.String(80), unique=True)
+    description = db.Column(db.String(255))
+
+
+class User(db.Model, UserMixin):
+    id = db.Column(db.Integer, primary_key=True)
+    date_created = db.Column(db.DateTime, server_default=func.now())
+    date_modified = db.Column(db.DateTime, onupdate=func.now())
+    email = db.Column(db.String(255), unique=True)
+    password = db.Column(db.String(255))
+    active = db.Column(db.Boolean())
+    confirmed_at = db.Column(db.DateTime())
+    roles = db.relationship("Role", secondary=roles_users, backref=db.backref("users", lazy="dynamic"))
+
+
+##############
+# load test
+##############
+
+from concurrent.futures import ThreadPoolExecutor
+from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+class PooledWSGIServer(BaseWSGIServer):
+    """Serves requests from fixed number of threads, like sync workers of gunicorn/uwsgi"""
+    request_queue_size = 256
+
+    def __init__(self, host, port, app, workers):
+        BaseWSGIServer.__init__(self, host, port, app, handler=QuietRequestHandler)
+        self.pool = ThreadPoolExecutor(workers)
+
+    def process_request(self, request, client_address):
+        self.pool.submit(self._process_request, request, client_address)
+
+    def _process_request(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+
+def run_login_storm(app, storm, duration, email, password):
+    """Hammer '/login' from storm clients and probe '/marketing' latency. Returns latencies and login statuses"""
+    import http.client
+    import urllib.parse
+
+    server = PooledWSGIServer("127.0.0.1", 0, app, app.config["ADMISSION_WORKERS"])
+    port = server.server_address[1]
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    stop = threading.Event()
+    statuses = {}
+    latencies = []
+    body = urllib.parse.urlencode({"email": email, "password": password})
+
+    def call(method, path, body=None):
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+        try:
+            conn.request(method, path, body, {"Content-Type": "application/x-www-form-urlencoded"})
+            response = conn.getresponse()
+            response.read()
+            return response
+        finally:
+            conn.close()
+
+    def login_client():
+        while not stop.is_set():
+            response = call("POST", "/login", body)
+            statuses[response.status] = statuses.get(response.status, 0) + 1
+            if response.status == 503:
+                stop.wait(float(response.getheader("Retry-After", 1)))
+
+    def probe():
+        while not stop.is_set():
+            start = time.time()
+            call("GET", "/marketing")
+            latencies.append(time.time() - start)
+            stop.wait(0.05)
+
+    threads = [threading.Thread(target=login_client) for _ in range(storm)] + [threading.Thread(target=probe)]
+    for thread in threads:
+        thread.start()
+    time.sleep(duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    server.shutdown()
+    server.pool.shutdown()
+    server.server_close()
+    return sorted(latencies), statuses
+
+
+################################################################################################
+# configuration (Do NOT commit passwords/secrets. See skeleton example to handle them securely)
+################################################################################################
+
+class Config(object):
+    # sqlalchemy
+    SQLALCHEMY_DATABASE_URI = "sqlite:///temp.sqlite3"
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+    SECRET_KEY = "<my-secret-key>"
+    # flask-security
+    SECURITY_PASSWORD_HASH = "bcrypt"
+    SECURITY_PASSWORD_SALT = "<my-random-hash>"
+    SECURITY_REGISTERABLE = True
+    SECURITY_SEND_REGISTER_EMAIL = False
+    # flask-mail - if using gmail, make sure to enable access for less secure apps, from google security settings
+    MAIL_SERVER = "smtp.gmail.com"
+    MAIL_PORT = 587
+    MAIL_USE_TLS = True
+    MAIL_USERNAME = ""
+    MAIL_PASSWORD = ""
+    # flask-admin
+    FLASK_ADMIN_SWATCH = "cerulean"
+    # admission control
+    ADMISSION_ENABLED = True
+    ADMISSION_WORKERS = 16
+    ADMISSION_RESERVED_WORKERS = 4
+    ADMISSION_CLASSES = {
+        "hashing": {"limit": 4, "max_limit": 8, "target_latency": 1.0, "priority": "low", "retry_after": 1},
+        "db": {"limit": 4, "max_limit": 8, "target_latency": 0.5, "priority": "low", "retry_after": 1},
+        "cheap": {"limit": 12, "max_limit": 16, "target_latency": 0.1, "priority": "high", "queue_timeout": 1},
+    }
+    ADMISSION_ROUTES = {
+        "security.login": "hashing",
+        "security.register": "hashing",
+        "security.change_password": "hashing",
+        "security.reset_password": "hashing",
+        "admin": "db",
+        "user": "db",
+        "role": "db",
+    }
+    ADMISSION_DEFAULT_CLASS = "cheap"
+
+
+#######################
+# application factory
+#######################
+
+def create_app():
+    app = Flask(__name__)
+    app.config.from_object(Config)
+
+    # initialize flask-extensions
+    mail.init_app(app)
+    jwt.init_app(app)
+    from flask_security import SQLAlchemyUserDatastore
+    user_datastore = SQLAlchemyUserDatastore(db, User, Role)
+    security.init_app(app, user_datastore)
+    db.init_app(app)
+    admission.init_app(app)
+
+    with app.app_context():
+        db.create_all()
+
+        # init admin
+        from flask_admin import Admin
+        from flask_admin.contrib.sqla import ModelView
+        admin = Admin(app, name="microblog", template_mode="bootstrap3")
+        admin.add_view(ModelView(User, db.session))
+        admin.add_view(ModelView(Role, db.session))
+
+        @app.route("/home")
+        @login_required
+        def home():
+            """Protected view"""
+            return "<h3> Secured Sweet Home where no worries !!!! <h3>"
+
+        @app.route("/marketing")
+        def test():
+            """Unprotected view"""
+            return "<h3> Marketing page open to all <h3>"
+
+        @app.route("/create-api-token")
+        @login_required
+        def create_or_get_token():
+            """Return jwt token if existing, else create new and return"""
+            access_token = create_access_token(identity=current_user)
+            return jsonify({"access_token": access_token}), 200
+
+        @app.route("/api/jwttest")
+        @jwt_required
+        def jwttest():
+            """View protected by jwt test"""
+            return jsonify({"foo": "bar", "baz": "qux"})
+
+        @app.route("/admission")
+        @cost_class("cheap")
+        def admission_stats():
+            return jsonify(admission.stats())
+
+    @app.cli.command("load-test")
+    @click.option("--storm", default=32, help="Number of concurrent login clients")
+    @click.option("--duration", default=5.0, help="Seconds per run")
+    def load_test(storm, duration):
+        """Run login storm with admission control off and on, and compare '/marketing' latency"""
+        from datetime import datetime
+        from flask_security.utils import hash_password
+        email, password = "loadtest@example.com", "password"
+        if user_datastore.get_user(email) is None:
+            user_datastore.create_user(email=email, password=hash_password(password), confirmed_at=datetime.utcnow())
+            db.session.commit()
+        app.config["WTF_CSRF_ENABLED"] = False
+
+        click.echo("%-14s %10s %10s %10s %12s %12s" % ("admission", "p50 ms", "p99 ms", "max ms", "logins ok", "logins 503"))
+        for enabled in (False, True):
+            app.config["ADMISSION_ENABLED"] = enabled
+            admission.reset()
+            latencies, statuses = run_login_storm(app, storm, duration, email, password)
+            p50 = latencies[len(latencies) // 2]
+            p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+            ok = sum(count for status, count in statuses.items() if status < 400)
+            click.echo("%-14s %10.1f %10.1f %10.1f %12d %12d" % (
+                "on" if enabled else "off", p50 * 1000, p99 * 1000, latencies[-1] * 1000, ok, statuses.get(503, 0)))
+        click.echo("final limits | %s" % ", ".join(
+            "%s=%.2f" % (name, cls.limit) for name, cls in sorted(admission.classes.items())))
+
+    return app
+
+
+if __name__ == "__main__":
+    app = create_app()
+    app.run(threaded=True)
@@ -0,0 +1,493 @@
+"""
+flask-bloom-filter-example.py
+
+Requirements:
+ Click==7.0
+ Flask==1.0.2
+ Flask-Login==0.4.1
+ Flask-SQLAlchemy==2.3.2
+ Flask-WTF==0.14.2
+ itsdangerous==1.1.0
+ Jinja2==2.10
+ MarkupSafe==1.1.0
+ SQLAlchemy==1.2.17
+ Werkzeug==0.14.1
+ WTForms==2.2.1
+
+Usage:
+ - Run script using 'python flask-bloom-filter-example.py'
+ - Visit below urls
+    - url without login protection 'http://127.0.0.1:5000/marketing'
+    - url with login protection 'http://127.0.0.1:5000/home'
+ - Create many users to play with using 'FLASK_APP=flask-bloom-filter-example.py flask seed-users --count 100000'
+ - Rebuild filter and its snapshot using 'FLASK_APP=flask-bloom-filter-example.py flask rebuild-email-filter'
+ - Show memory use and false positive rate using 'FLASK_APP=flask-bloom-filter-example.py flask email-filter-stats'
+
+Notes:
+    - 'RegisterForm.validate_email' normally queries 'user' table on every registration attempt, even for spam.
+    - Here a bloom filter of all registered emails sits in front of that query.
+        - If email is not in filter, it is definitely not taken, so no query is made.
+        - If email is in filter, it is probably taken, and unique index is queried to be sure.
+    - Filter is built at startup from snapshot file 'EMAIL_FILTER_SNAPSHOT', and only users created after
+      snapshot are scanned. Without snapshot, all emails are scanned in batches of 'EMAIL_FILTER_SCAN_BATCH'.
+      New users are added to filter on insert.
+    - Snapshot records 'max_id', id of last user included. It only moves forward after a database scan, never on
+      this worker's own inserts, because other workers insert ids in between. Snapshot is written on exit after a
+      scan too, and by 'rebuild-email-filter'. This relies on ids being committed in order, which holds for sqlite
+      (single writer). With concurrent writers (postgres) rebuild snapshot offline instead of on exit.
+    - Each worker has its own filter, so it may miss a user registered by other worker a moment ago. Unique
+      constraint on 'user.email' still protects, and registration shows same error in that case.
+    - Emails are normalized (stripped and lowercased) before they are stored, checked and added to filter.
+    - Filter is sized for 'EMAIL_FILTER_CAPACITY' emails with 'EMAIL_FILTER_ERROR_RATE' false positives
+      (about 1.2 MB for 1M emails at 1%). Past capacity, false positive rate grows; rebuild to resize.
+      Snapshot keeps capacity and error rate it was built with, so changing config takes effect on rebuild only.
+    - Same check can be used in flask-security's register forms by overriding their 'validate' method.
+
+References:
+ - https://en.wikipedia.org/wiki/Bloom_filter
+ - https://www.eecs.harvard.edu/~michaelm/postscripts/rsa2008.pdf (double hashing)
+ - https://flask-login.readthedocs.io/en/latest/
+"""
+import atexit
+import hashlib
+import math
+import os
+import struct
+import threading
+
+import click
+from flask import Flask, flash, redirect, render_template_string, url_for, request
+from sqlalchemy import event
+from sqlalchemy.exc import IntegrityError
+from werkzeug.security import generate_password_hash, check_password_hash
+
+# flask-sqlalchemy setup
+from flask_sqlalchemy import SQLAlchemy
+db = SQLAlchemy()
+
+# flask-login setup
+from flask_login import LoginManager, current_user, login_required, login_user, logout_user
+login_manager = LoginManager()
+
+# csrf setup
+from flask_wtf.csrf import CSRFProtect
+csrf = CSRFProtect()
+
+
+###############
+# bloom filter
+###############
+
+class BloomFilter(object):
+    """Bloom filter over bytearray using double hashing of one blake2b digest"""
+
+    HEADER = struct.Struct("<4sQdQQQQ")
+    MAGIC = b"BLM2"
+
+    def __init__(self, capacity, error_rate, bits=None, hashes=None):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.size = bits or max(8, int(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)))
+        self.hashes = hashes or max(1, int(round(self.size / float(capacity) * math.log(2))))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def _positions(self, key):
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+        h1, h2 = struct.unpack("<QQ", digest)
+        h2 |= 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, key):
+        positions = self._positions(key)
+        with self._lock:
+            for position in positions:
+                self.bits[position >> 3] |= 1 << (position & 7)
+            self.count += 1
+
+    def __contains__(self, key):
+        bits = self.bits
+        for position in self._positions(key):
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+    def estimated_error_rate(self):
+        """Expected false positive rate for current number of items"""
+        return (1 - math.exp(-self.hashes * self.count / float(self.size))) ** self.hashes
+
+    def dump(self, path, max_id):
+        """Write snapshot atomically. 'max_id' is id of last user included in filter"""
+        tmp = "%s.%d.tmp" % (path, os.getpid())
+        with open(tmp, "wb") as f:
+            f.write(self.HEADER.pack(self.MAGIC, self.capacity, self.error_rate, self.size, self.hashes,
+                                     self.count, max_id))
+            with self._lock:
+                f.write(self.bits)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        """Return (filter, max_id) from snapshot"""
+        with open(path, "rb") as f:
+            header = f.read(cls.HEADER.size)
+            if len(header) != cls.HEADER.size or header[:4] != cls.MAGIC:
+                raise ValueError("Not a bloom filter snapshot or old format | %s" % path)
+            _, capacity, error_rate, size, hashes, count, max_id = cls.HEADER.unpack(header)
+            bloom = cls(capacity, error_rate, bits=size, hashes=hashes)
+            bloom.bits = bytearray(f.read())
+            bloom.count = count
+        if len(bloom.bits) != (size + 7) // 8:
+            raise ValueError("Truncated bloom filter snapshot | %s" % path)
+        return bloom, max_id
+
+
+def normalize_email(email):
+    return (email or "").strip().lower()
+
+
+class EmailFilter(object):
+    """Keeps bloom filter of registered emails in sync with 'User' table"""
+
+    def __init__(self, app=None):
+        self.bloom = None
+        self.max_id = 0
+        self.stats = {"checks": 0, "definitely_free": 0, "possible_hits": 0, "false_positives": 0}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("EMAIL_FILTER_CAPACITY", 1000000)
+        app.config.setdefault("EMAIL_FILTER_ERROR_RATE", 0.01)
+        app.config.setdefault("EMAIL_FILTER_SNAPSHOT", "email-filter.bin")
+        app.config.setdefault("EMAIL_FILTER_SCAN_BATCH", 10000)
+        self.app = app
+        app.extensions["email_filter"] = self
+        event.listen(User, "after_insert", self._after_insert)
+        atexit.register(self.save)
+
+    def _after_insert(self, mapper, connection, target):
+        if self.bloom is not None:
+            # 'max_id' stays. Rows inserted by other workers below this id are not in filter yet
+            self.bloom.add(normalize_email(target.email))
+
+    def load(self):
+        """Load snapshot if present and scan users created after it, else build from scratch"""
+        config = self.app.config
+        path = config["EMAIL_FILTER_SNAPSHOT"]
+        if path and os.path.exists(path):
+            try:
+                self.bloom, self.max_id = BloomFilter.load(path)
+            except ValueError as e:
+                self.app.logger.warning("Ignoring email filter snapshot | %s" % e)
+                return self.rebuild()
+            self._scan(self.bloom, self.max_id)
+            self.app.logger.info("Email filter loaded from snapshot | %d emails" % self.bloom.count)
+            return self.bloom
+        return self.rebuild()
+
+    def rebuild(self):
+        """Build fresh filter from full scan of users and write snapshot"""
+        config = self.app.config
+        total = db.session.query(db.func.count(User.id)).scalar()
+        capacity = max(config["EMAIL_FILTER_CAPACITY"], 2 * total)
+        bloom = BloomFilter(capacity, config["EMAIL_FILTER_ERROR_RATE"])
+        self.max_id = self._scan(bloom, 0)
+        self.bloom = bloom
+        if config["EMAIL_FILTER_SNAPSHOT"]:
+            bloom.dump(config["EMAIL_FILTER_SNAPSHOT"], self.max_id)
+        self.app.logger.info("Email filter rebuilt | %d emails" % bloom.count)
+        return bloom
+
+    def _scan(self, bloom, after_id):
+        """Add emails of users with id > after_id, scanning in id order in batches. Return last seen id"""
+        batch_size = self.app.config["EMAIL_FILTER_SCAN_BATCH"]
+        last_id = after_id
+        while True:
+            rows = db.session.query(User.id, User.email).filter(User.id > last_id) \
+                .order_by(User.id).limit(batch_size).all()
+            for id, email in rows:
+                bloom.add(normalize_email(email))
+            if len(rows) < batch_size:
+                return rows[-1][0] if rows else last_id
+            last_id = rows[-1][0]
+
+    def save(self):
+        """Scan users after 'max_id' and write snapshot, so every row up to new 'max_id' is in it. Runs on exit"""
+        path = self.app.config["EMAIL_FILTER_SNAPSHOT"] if self.bloom is not None else None
+        if path:
+            with self.app.app_context():
+                self.max_id = self._scan(self.bloom, self.max_id)
+            self.bloom.dump(path, self.max_id)
+
+    def is_taken(self, email):
+        """True if email is registered. Queries database only when filter says 'maybe'"""
+        email = normalize_email(email)
+        self.stats["checks"] += 1
+        if self.bloom is not None and email not in self.bloom:
+            self.stats["definitely_free"] += 1
+            return False
+        self.stats["possible_hits"] += 1
+        taken = db.session.query(User.id).filter_by(email=email).first() is not None
+        if not taken:
+            self.stats["false_positives"] += 1
+        if self.bloom is not None and self.bloom.count > self.bloom.capacity:
+            self.app.logger.warning("Email filter is over capacity, rebuild it | %d emails" % self.bloom.count)
+        return taken
+
+
+##################
+# database models
+##################
+
+from flask_login import UserMixin
+from sqlalchemy.sql import func
+
+
+class User(db.Model, UserMixin):
+    id = db.Column(db.Integer, primary_key=True)
+    date_created = db.Column(db.DateTime, server_default=func.now())
+    date_modified = db.Column(db.DateTime, onupdate=func.now())
+    email = db.Column(db.String(255), unique=True)
+    password = db.Column(db.String(255))
+    first_name = db.Column(db.String(255))
+    last_name = db.Column(db.String(255))
+
+
+email_filter = EmailFilter()
+
+
+####################
+# login forms
+####################
+
+from flask_wtf.form import FlaskForm
+from wtforms import StringField, PasswordField
+from wtforms.fields.html5 import EmailField
+from wtforms.validators import Email, Length, InputRequired, ValidationError
+
+
+class RegisterForm(FlaskForm):
+    first_name = StringField("First Name", validators=[InputRequired(), Length(max=32)])
+    last_name = StringField("Last Name", validators=[InputRequired(), Length(max=32)])
+    email = EmailField("Email", validators=[InputRequired(), Email()], filters=[normalize_email])
+    password = PasswordField("Password", validators=[InputRequired(), Length(min=5, max=32)])
+
+    def validate_email(self, email):
+        if email_filter.is_taken(email.data):
+            raise ValidationError("Please use a different email")
+
+
+class LoginForm(FlaskForm):
+    email = EmailField("Email", validators=[InputRequired(), Email()], filters=[normalize_email])
+    password = PasswordField("Password", validators=[InputRequired(), Length(min=5, max=32)])
+
+
+####################
+# Sample templates
+###################
+
+register_template = """
+<form method="post" action="{{ url_for('register') }}">
+    {{ form.csrf_token }}
+  <h1>Sign up</h1>
+        {% with messages = get_flashed_messages() %}
+        {% if messages %}
+        {% for message in messages %}
+                {{ message }}
+        {% endfor %}
+        {% endif %}
+        {% endwith %}
+
+    <p><input type="text"  name="first_name" placeholder="First Name" required autofocus></p>
+    <p><input type="text" name="last_name" placeholder="Last Name" required autofocus></p>
+    <p><input type="text" name="email" placeholder="email" required autofocus></p>
+    <p><input type="password" name="password" placeholder="password" required></p>
+    <p><button type="submit">Register</button></p>
+    <p><a href="{{ url_for('login') }}">Already have account ?</a></p>
+</form>
+"""
+
+login_template = """
+<form method="post" action="{{ url_for('login') }}">
+    {{ form.csrf_token }}
+        <h1> Login </h1>
+        {% with messages = get_flashed_messages() %}
+        {% if messages %}
+        {% for message in messages %}
+           {{ message }}
+        {% endfor %}
+        {% endif %}
+        {% endwith %}
+
+    <p><input type="text" name="email" placeholder="email" required autofocus></p>
+    <p><input type="password" name="password" placeholder="password" required></p>
+    <p><button class="btn btn-lg btn-primary btn-block" type="submit">Sign in</button></p>
+    <p><a href="{{ url_for('register') }}">Not registered ?</a></p>
+</form>
+"""
+
+home_template = """
+<h3> Secured Sweet Home where no worries !!!! <h3>
+<p><a href="{{ url_for('logout') }}">Logout</a></p>
+"""
+
+
+##########
+# Helpers
+##########
+
+def flash_errors(form):
+    """Generate flashes form errors"""
+    for field, errors in form.errors.items():
+        for error in errors:
+            flash(u"Error in the %s field - %s" % (
+                getattr(form, field).label.text,
+                error
+            ), 'error')
+
+
+################################################################################################
+# configuration (Do NOT commit passwords/secrets. See skeleton example to handle them securely)
+################################################################################################
+
+class Config(object):
+    # sqlalchemy
+    SQLALCHEMY_DATABASE_URI = "sqlite:///temp.sqlite3"
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+    SECRET_KEY = "<my-secret-key>"
+    # email filter
+    EMAIL_FILTER_CAPACITY = 1000000
+    EMAIL_FILTER_ERROR_RATE = 0.01
+    EMAIL_FILTER_SNAPSHOT = "email-filter.bin"
+    EMAIL_FILTER_SCAN_BATCH = 10000
+
+
+#######################
+# application factory
+#######################
+
+def create_app():
+    app = Flask(__name__)
+    app.config.from_object(Config)
+
+    # initialize extensions
+    csrf.init_app(app)
+    login_manager.init_app(app)
+    login_manager.login_view = "login"
+    db.init_app(app)
+    email_filter.init_app(app)
+
+    with app.app_context():
+        db.create_all()
+        email_filter.load()
+
+        ##############
+        # Controllers
+        ##############
+
+        @login_manager.user_loader
+        def load_user(id):
+            return User.query.get(int(id))
+
+        @app.route("/register", endpoint="register", methods=["GET", "POST"])
+        def register():
+            """Handle register request"""
+            if current_user.is_authenticated:
+                return redirect(url_for('home'))
+            form = RegisterForm(request.form)
+            if request.method == "POST" and form.validate_on_submit():
+                password = generate_password_hash(form.password.data, method="sha256")
+                user = User(first_name=form.first_name.data, last_name=form.last_name.data, email=form.email.data,
+                            password=password)
+                db.session.add(user)
+                try:
+                    db.session.commit()
+                except IntegrityError:
+                    # registered meanwhile through other worker, which this worker's filter did not know yet
+                    db.session.rollback()
+                    flash("Error in the Email field - Please use a different email", "error")
+                    return render_template_string(register_template, form=form)
+                login_user(user)
+                app.logger.info("New user registered successfully using form | %s" % user.email)
+                return redirect(url_for("home"))
+            else:
+                flash_errors(form)
+            return render_template_string(register_template, form=form)
+
+        @app.route("/login", endpoint="login", methods=["GET", "POST"])
+        def login():
+            """Handle login request."""
+            if current_user.is_authenticated:
+                return redirect(url_for("home"))
+            form = LoginForm(request.form)
+            if request.method == "POST" and form.validate():
+                user = User.query.filter_by(email=form.email.data).first()
+                if user is None or not check_password_hash(user.password, form.password.data):
+                    flash("Invalid username/password")
+                    return render_template_string(login_template, form=form)
+                login_user(user)
+                app.logger.debug("User login successful | %s" % user.email)
+                return redirect(url_for("home"))
+            else:
+                flash_errors(form)
+            return render_template_string(login_template, form=form)
+
+        @app.route("/logout", endpoint="logout")
+        @login_required
+        def logout():
+            """Handle logout request"""
+            logout_user()
+            return redirect(url_for("login"))
+
+        @app.route("/home", endpoint="home")
+        @app.route("/")
+        @login_required
+        def home():
+            """Home page view. Protected view"""
+            return render_template_string(home_template)
+
+        @app.route("/marketing", endpoint="marketing")
+        def marketing():
+            """Unprotected view"""
+            return "<h3> This is marketing page </h3>"
+
+    @app.cli.command("seed-users")
+    @click.option("--count", default=100000, help="Number of users to create")
+    def seed_users(count):
+        """Bulk create users 'seed<N>@example.com' with same password"""
+        password = generate_password_hash("password", method="sha256")
+        start = db.session.query(db.func.count(User.id)).scalar()
+        for offset in range(0, count, 10000):
+            db.session.execute(User.__table__.insert(), [
+                {"email": "seed%d@example.com" % i, "password": password, "first_name": "seed", "last_name": "user"}
+                for i in range(start + offset, start + min(offset + 10000, count))])
+        db.session.commit()
+        click.echo("Created %d users. Run 'flask rebuild-email-filter' to include them in snapshot" % count)
+
+    @app.cli.command("rebuild-email-filter")
+    def rebuild_email_filter():
+        """Rebuild email filter from full scan of users and write snapshot"""
+        bloom = email_filter.rebuild()
+        click.echo("Email filter rebuilt | %d emails | snapshot %s" % (bloom.count, app.config["EMAIL_FILTER_SNAPSHOT"]))
+
+    @app.cli.command("email-filter-stats")
+    @click.option("--probes", default=100000, help="Number of unregistered emails to measure false positive rate")
+    def email_filter_stats(probes):
+        """Show memory use, estimated and measured false positive rate of email filter"""
+        bloom = email_filter.bloom
+        false_positives = sum(1 for i in range(probes) if "probe%d@example.invalid" % i in bloom)
+        click.echo("emails:              %d (capacity %d)" % (bloom.count, bloom.capacity))
+        click.echo("bits / hashes:       %d / %d" % (bloom.size, bloom.hashes))
+        click.echo("memory:              %.1f KB" % (len(bloom.bits) / 1024.0))
+        click.echo("estimated fp rate:   %.4f%%" % (bloom.estimated_error_rate() * 100))
+        click.echo("measured fp rate:    %.4f%% (%d of %d probes)" % (
+            false_positives * 100.0 / probes, false_positives, probes))
+
+    return app
+
+
+if __name__ == "__main__":
+    app = create_app()
+    app.run()
@@ -0,0 +1,267 @@
+"""
+flask-fast-json-example.py
+
+Requirements:
+ Click==7.0
+ Flask==1.0.2
+ itsdangerous==1.1.0
+ Jinja2==2.10
+ MarkupSafe==1.1.0
+ Werkzeug==0.14.1
+ orjson==3.0.0 (optional)
+ ujson==1.35 (optional)
+
+Usage:
+ - Run script using 'python flask-fast-json-example.py'
+ - Visit below urls
+    - paginated user list 'http://127.0.0.1:5000/api/users?page=1&per_page=100'
+    - streamed user list 'http://127.0.0.1:5000/api/users/stream'
+ - Run serialization benchmark using 'FLASK_APP=flask-fast-json-example.py flask bench-json --count 10000'
+
+Notes:
+    - 'flask.jsonify' always uses stdlib 'json'. Here 'jsonify' is replaced by a small extension which picks
+      fastest available backend in order orjson, ujson, json. Set 'JSON_BACKEND' config to force one.
+    - Output is pretty printed only if 'JSONIFY_PRETTYPRINT_REGULAR' is set or app is in debug mode, same as flask.
+    - Keys are sorted only if 'JSON_SORT_KEYS' is set. Sorting is disabled in Config below as it is not free.
+    - 'jsonify' accepts same arguments as 'flask.jsonify', including non string dict keys. Differences are
+        - orjson serializes datetime as ISO-8601 string, while flask uses http date. Other types fallback to flask encoder.
+        - ujson has no fallback hook, so types like datetime, uuid or decimal raise TypeError (500) with ujson backend.
+        - ujson 1.x writes 'None', 'True' and 'False' dict keys as "None", "True", "False" instead of "null",
+          "true", "false". Int keys are fine. Use orjson or json backend if such keys are used.
+        - float formatting and escaping of non ascii characters may differ, parsed values are same.
+    - Streamed responses are always compact and are written in chunks of 'JSON_STREAM_CHUNK_SIZE' items,
+      so memory usage does not grow with size of list.
+
+References:
+ - http://flask.pocoo.org/docs/1.0/api/#module-flask.json
+ - http://flask.pocoo.org/docs/1.0/patterns/streaming/
+ - https://github.com/ijl/orjson
+"""
+import json
+import timeit
+
+import click
+from flask import Flask, current_app, request, url_for, stream_with_context
+from flask.json import JSONEncoder
+
+
+###################
+# json backends
+###################
+
+def _flask_default(obj):
+    """Fallback for objects which backend can not serialize. Same rules as flask.json.JSONEncoder"""
+    return JSONEncoder().default(obj)
+
+
+def _orjson_backend():
+    import orjson
+
+    def dumps(obj, pretty=False, sort_keys=False):
+        # flask (stdlib json) converts int/float/bool/None dict keys to strings. orjson raises TypeError without it
+        option = orjson.OPT_NON_STR_KEYS
+        if pretty:
+            option |= orjson.OPT_INDENT_2
+        if sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        return orjson.dumps(obj, default=_flask_default, option=option)
+    return dumps
+
+
+def _ujson_backend():
+    import ujson
+
+    def dumps(obj, pretty=False, sort_keys=False):
+        # ujson has no 'default' hook, so unsupported types raise TypeError. None/bool dict keys differ, see Notes
+        return ujson.dumps(obj, indent=2 if pretty else 0, sort_keys=sort_keys, ensure_ascii=False).encode("utf-8")
+    return dumps
+
+
+def _json_backend():
+    def dumps(obj, pretty=False, sort_keys=False):
+        if pretty:
+            return json.dumps(obj, indent=2, separators=(", ", ": "), sort_keys=sort_keys,
+                              default=_flask_default).encode("utf-8")
+        return json.dumps(obj, separators=(",", ":"), sort_keys=sort_keys, default=_flask_default).encode("utf-8")
+    return dumps
+
+
+JSON_BACKENDS = [
+    ("orjson", _orjson_backend),
+    ("ujson", _ujson_backend),
+    ("json", _json_backend),
+]
+
+
+def load_backend(name=None):
+    """Return (name, dumps) for given backend or for fastest installed backend if name is None"""
+    for backend_name, factory in JSON_BACKENDS:
+        if name is not None and name != backend_name:
+            continue
+        try:
+            return backend_name, factory()
+        except ImportError:
+            if name is not None:
+                raise
+    raise ValueError("Unknown json backend %r" % name)
+
+
+def available_backends():
+    """Return list of (name, dumps) for all installed backends"""
+    backends = []
+    for backend_name, factory in JSON_BACKENDS:
+        try:
+            backends.append((backend_name, factory()))
+        except ImportError:
+            pass
+    return backends
+
+
+#####################
+# flask extension
+#####################
+
+class FastJSON(object):
+    """Pluggable json serializer used by 'jsonify' and 'stream_json_list' below"""
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("JSON_BACKEND", None)
+        app.config.setdefault("JSON_STREAM_CHUNK_SIZE", 1000)
+        backend_name, dumps = load_backend(app.config["JSON_BACKEND"])
+        app.extensions["fast_json"] = {"backend": backend_name, "dumps": dumps}
+        app.logger.debug("Using json backend | %s" % backend_name)
+
+    @staticmethod
+    def dumps(obj, pretty=None):
+        """Serialize obj to bytes using backend configured for current app"""
+        config = current_app.config
+        if pretty is None:
+            pretty = config["JSONIFY_PRETTYPRINT_REGULAR"] or current_app.debug
+        dumps = current_app.extensions["fast_json"]["dumps"]
+        return dumps(obj, pretty=pretty, sort_keys=config["JSON_SORT_KEYS"])
+
+
+fast_json = FastJSON()
+
+
+def jsonify(*args, **kwargs):
+    """Replacement of flask.jsonify using fast backend. See Notes for differences"""
+    if args and kwargs:
+        raise TypeError("jsonify() behavior undefined when passed both args and kwargs")
+    elif len(args) == 1:
+        data = args[0]
+    else:
+        data = args or kwargs
+    body = fast_json.dumps(data) + b"\n"
+    return current_app.response_class(body, mimetype=current_app.config["JSONIFY_MIMETYPE"])
+
+
+def stream_json_list(key, items, **extra):
+    """
+    Stream '{<extra>, key: [items...]}' without building full list in memory.
+    Items are serialized in chunks to keep per item overhead of backend call low.
+    """
+    dumps = current_app.extensions["fast_json"]["dumps"]
+    chunk_size = current_app.config["JSON_STREAM_CHUNK_SIZE"]
+
+    def generate():
+        head = dumps(extra)[:-1]
+        yield head + (b"," if extra else b"") + dumps(key) + b":["
+        chunk = []
+        first = True
+        for item in items:
+            chunk.append(item)
+            if len(chunk) >= chunk_size:
+                yield (b"" if first else b",") + dumps(chunk)[1:-1]
+                first = False
+                chunk = []
+        if chunk:
+            yield (b"" if first else b",") + dumps(chunk)[1:-1]
+        yield b"]}\n"
+
+    return current_app.response_class(stream_with_context(generate()), mimetype=current_app.config["JSONIFY_MIMETYPE"])
+
+
+###################################################
+# sample data (Instead of actual database, we are
+# generating users on the fly)
+###################################################
+
+def iter_users(start, stop):
+    for id in range(start, stop):
+        yield {"id": id, "username": "user%d" % id, "email": "user%d@example.com" % id, "roles": ["role1", "role2"]}
+
+
+################################################################################################
+# configuration (Do NOT commit passwords/secrets. See skeleton example to handle them securely)
+################################################################################################
+
+class Config(object):
+    SECRET_KEY = "<my-secret-key>"
+    # json
+    JSON_BACKEND = None
+    JSON_SORT_KEYS = False
+    JSONIFY_PRETTYPRINT_REGULAR = False
+    JSON_STREAM_CHUNK_SIZE = 1000
+    # sample data
+    USER_COUNT = 1000000
+    USERS_PER_PAGE = 100
+    USERS_MAX_PER_PAGE = 1000
+
+
+#######################
+# application factory
+#######################
+
+def create_app():
+    app = Flask(__name__)
+    app.config.from_object(Config)
+
+    fast_json.init_app(app)
+
+    @app.route("/api/users", methods=["GET"])
+    def list_users():
+        """Paginated user list"""
+        total = app.config["USER_COUNT"]
+        page = max(request.args.get("page", 1, type=int), 1)
+        per_page = request.args.get("per_page", app.config["USERS_PER_PAGE"], type=int)
+        per_page = min(max(per_page, 1), app.config["USERS_MAX_PER_PAGE"])
+        start = (page - 1) * per_page
+        stop = min(start + per_page, total)
+        next_url = url_for("list_users", page=page + 1, per_page=per_page) if stop < total else None
+        user_list = list(iter_users(start, stop))
+        return jsonify({"type": "+OK", "msg": "success", "total": total, "page": page, "next": next_url,
+                        "users": user_list}), 200
+
+    @app.route("/api/users/stream", methods=["GET"])
+    def stream_users():
+        """Full user list streamed in chunks"""
+        total = app.config["USER_COUNT"]
+        return stream_json_list("users", iter_users(0, total), type="+OK", msg="success", total=total)
+
+    @app.cli.command("bench-json")
+    @click.option("--count", default=10000, help="Number of users in payload")
+    @click.option("--repeat", default=5, help="Number of timing runs. Best run is reported")
+    def bench_json(count, repeat):
+        """Compare serialization speed of installed json backends"""
+        payload = {"type": "+OK", "msg": "success", "users": list(iter_users(0, count))}
+        click.echo("%-8s %-8s %12s %12s %10s" % ("backend", "mode", "ms/op", "MB/s", "bytes"))
+        for name, dumps in available_backends():
+            for pretty in (False, True):
+                size = len(dumps(payload, pretty=pretty))
+                number = max(1, 200000 // count)
+                best = min(timeit.repeat(lambda: dumps(payload, pretty=pretty), number=number, repeat=repeat))
+                per_op = best / number
+                click.echo("%-8s %-8s %12.3f %12.1f %10d" % (
+                    name, "pretty" if pretty else "compact", per_op * 1000, size / per_op / 1e6, size))
+
+    return app
+
+
+if __name__ == "__main__":
+    app = create_app()
+    app.run()
@@ -0,0 +1,390 @@
+"""
+flask-jwt-key-rotation-example.py
+
+Requirements:
+ Click==7.0
+ cryptography==2.6.1
+ Flask==1.0.2
+ Flask-JWT-Extended==3.25.1
+ itsdangerous==1.1.0
+ Jinja2==2.10
+ MarkupSafe==1.1.0
+ PyJWT==1.7.1
+ Werkzeug==0.14.1
+
+
+Usage:
+- Create first signing key using 'FLASK_APP=flask-jwt-key-rotation-example.py flask keyring-generate --alg RS256'
+- Run script as 'python flask-jwt-key-rotation-example.py'
+- To generate token, send POST request to '/api/auth/create_token' with username and password.
+- To use token, add 'authorization' header with value 'Bearer <access_token>'
+- Schedule next key, active in one hour, using 'flask keyring-generate --alg RS256 --activate-in 3600'
+- Retire keys older than token lifetime using 'flask keyring-retire <kid>' and remove them using 'flask keyring-prune'
+- Write keyring for verify-only nodes (public keys only) using 'flask keyring-export-public verify-keyring.json'
+- Compare issue/verify speed of algorithms using 'flask bench-jwt --count 2000'
+
+Notes:
+    - Instead of one static 'JWT_SECRET_KEY', keys live in keyring file 'JWT_KEYRING_PATH'. Every key has a 'kid',
+      algorithm, 'activate_at' and optional 'retire_at' time. Each token carries 'kid' in its header.
+    - Signing key is newest active key with private part, whose algorithm is 'JWT_ALGORITHM'. A key generated with
+      '--activate-in' is published to all nodes first and only starts signing later, so rollover needs no restart
+      and old tokens stay valid until their key is retired.
+    - Verification picks key by 'kid' and rejects unknown, retired or algorithm mismatched keys.
+    - Asymmetric keys (RS256, ES256) let verify-only nodes run with public keys only. They can never sign.
+      HS256 keys are shared secrets, so every node holding them can sign.
+    - Keys are parsed once into key objects and cached by 'kid'. Parsing PEM per request is expensive, specially
+      for RSA. Keyring file is re-read only when it changes (checked every 'JWT_KEYRING_RELOAD_INTERVAL' seconds).
+    - EdDSA is not offered. PyJWT supports it from 2.0, but flask-jwt-extended 3.x requires PyJWT<2 and this
+      example uses 3.x api ('@jwt_required', 'user_claims_loader').
+
+References:
+ - https://flask-jwt-extended.readthedocs.io/en/3.0.0_release/tokens_from_complex_object/
+ - https://pyjwt.readthedocs.io/en/latest/algorithms.html
+ - https://tools.ietf.org/html/rfc7515#section-4.1.4 (kid header)
+"""
+
+import base64
+import datetime
+import json
+import os
+import threading
+import time
+import uuid
+
+import click
+import jwt as pyjwt
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec, rsa
+from flask import Flask, current_app, g, has_app_context, jsonify, request
+from flask_jwt_extended import JWTManager, jwt_required, create_access_token
+from werkzeug.security import safe_str_cmp
+
+
+###########
+# key ring
+###########
+
+def _generate_hmac():
+    secret = base64.urlsafe_b64encode(os.urandom(32)).decode("ascii")
+    return {"secret": secret}
+
+
+def _generate_pem(private_key):
+    return {
+        "private_key": private_key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                                 serialization.NoEncryption()).decode("ascii"),
+        "public_key": private_key.public_key().public_bytes(
+            serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo).decode("ascii"),
+    }
+
+
+# algorithm -> key generator
+KEY_GENERATORS = {
+    "HS256": _generate_hmac,
+    "RS256": lambda: _generate_pem(rsa.generate_private_key(65537, 2048, default_backend())),
+    "ES256": lambda: _generate_pem(ec.generate_private_key(ec.SECP256R1(), default_backend())),
+}
+
+
+def supported_algorithms():
+    """Algorithms which both this keyring and installed PyJWT support"""
+    return [alg for alg in KEY_GENERATORS if alg in pyjwt.algorithms.get_default_algorithms()]
+
+
+class Key(object):
+    """Parsed key. 'signing_key' is None on verify-only nodes"""
+
+    def __init__(self, kid, alg, signing_key, verify_key, activate_at, retire_at):
+        self.kid = kid
+        self.alg = alg
+        self.signing_key = signing_key
+        self.verify_key = verify_key
+        self.activate_at = activate_at
+        self.retire_at = retire_at
+
+    @classmethod
+    def from_dict(cls, data):
+        if "secret" in data:
+            secret = data["secret"].encode("ascii")
+            signing_key = verify_key = secret
+        else:
+            signing_key = None
+            if data.get("private_key"):
+                signing_key = serialization.load_pem_private_key(data["private_key"].encode("ascii"), password=None,
+                                                                 backend=default_backend())
+            verify_key = serialization.load_pem_public_key(data["public_key"].encode("ascii"),
+                                                           backend=default_backend())
+        return cls(data["kid"], data["alg"], signing_key, verify_key, data["activate_at"], data.get("retire_at"))
+
+    def is_retired(self, now):
+        return self.retire_at is not None and self.retire_at <= now
+
+
+class KeyRing(object):
+    """kid indexed cache of parsed keys, loaded from json keyring file"""
+
+    def __init__(self, app=None):
+        self.keys = {}
+        self._mtime = None
+        self._next_check = 0
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("JWT_KEYRING_PATH", "keyring.json")
+        app.config.setdefault("JWT_KEYRING_RELOAD_INTERVAL", 10)
+        app.extensions["jwt_keyring"] = self
+
+    # keyring file
+
+    @staticmethod
+    def read_file(path):
+        if not os.path.exists(path):
+            return []
+        with open(path) as f:
+            return json.load(f)["keys"]
+
+    @staticmethod
+    def write_file(path, keys):
+        tmp = "%s.%d.tmp" % (path, os.getpid())
+        with open(tmp, "w") as f:
+            json.dump({"keys": keys}, f, indent=2)
+        os.replace(tmp, path)
+
+    def reload(self, force=False):
+        """Re-parse keyring file if its mtime changed. Unchanged keys keep their parsed objects"""
+        now = time.time()
+        if not force and now < self._next_check:
+            return
+        path = current_app.config["JWT_KEYRING_PATH"]
+        with self._lock:
+            self._next_check = now + current_app.config["JWT_KEYRING_RELOAD_INTERVAL"]
+            mtime = os.path.getmtime(path) if os.path.exists(path) else None
+            if mtime == self._mtime:
+                return
+            keys = {}
+            for data in self.read_file(path):
+                cached = self.keys.get(data["kid"])
+                if cached is not None and cached.activate_at == data["activate_at"] \
+                        and cached.retire_at == data.get("retire_at") \
+                        and (cached.signing_key is not None) == bool(data.get("private_key") or data.get("secret")):
+                    keys[data["kid"]] = cached
+                else:
+                    keys[data["kid"]] = Key.from_dict(data)
+            self.keys = keys
+            self._mtime = mtime
+
+    # lookups
+
+    def signing_key(self):
+        """Newest active key which can sign with 'JWT_ALGORITHM'. Fixed for app context, so header and
+        signature of one token always use same key, even during rollover"""
+        if has_app_context() and "_jwt_signing_key" in g:
+            return g._jwt_signing_key
+        self.reload()
+        now = time.time()
+        alg = current_app.config["JWT_ALGORITHM"]
+        candidates = [key for key in self.keys.values() if key.signing_key is not None and key.alg == alg
+                      and key.activate_at <= now and not key.is_retired(now)]
+        if not candidates:
+            raise RuntimeError("No active %s signing key in keyring. Run 'flask keyring-generate'" % alg)
+        key = max(candidates, key=lambda key: key.activate_at)
+        if has_app_context():
+            g._jwt_signing_key = key
+        return key
+
+    def verify_key(self, kid, alg):
+        self.reload()
+        key = self.keys.get(kid)
+        if key is None:
+            # may be a key published after last reload. Costs one stat() unless keyring file changed
+            self.reload(force=True)
+            key = self.keys.get(kid)
+        if key is None or key.is_retired(time.time()):
+            raise pyjwt.InvalidTokenError("Unknown or retired key | %s" % kid)
+        if key.alg != alg:
+            raise pyjwt.InvalidTokenError("Algorithm %s does not match key %s" % (alg, kid))
+        return key.verify_key
+
+
+keyring = KeyRing()
+
+
+class ConfigClass(object):
+    """Test Configuration"""
+    DEBUG = True
+    JWT_ALGORITHM = "RS256"
+    JWT_DECODE_ALGORITHMS = ["HS256", "RS256", "ES256"]
+    JWT_ACCESS_TOKEN_EXPIRES = datetime.timedelta(days=1)
+    JWT_KEYRING_PATH = "keyring.json"
+    JWT_KEYRING_RELOAD_INTERVAL = 10
+
+
+class User(object):
+    """Example User class"""
+    def __init__(self, id, username, password, roles):
+        self.id = id
+        self.username = username
+        self.password = password
+        self.roles = roles
+
+    def __str__(self):
+        return "User(id=%s)" % self.id
+
+
+# Instead of actual database, we are using here python variables to store data
+users = [
+    User(1, 'user1', 'pass1', ["role1", "role2"]),
+    User(2, 'user2', 'pass2', ["role3", "role4"]),
+]
+userid_table = {user.username: user for user in users}
+
+
+app = Flask(__name__)
+app.config.from_object(ConfigClass)
+app.config["JWT_DECODE_ALGORITHMS"] = [alg for alg in app.config["JWT_DECODE_ALGORITHMS"]
+                                       if alg in supported_algorithms()]
+jwt = JWTManager(app)
+keyring.init_app(app)
+
+
+@jwt.user_identity_loader
+def load_api_user(user):
+    """Generate tokens using specific attribute of object."""
+    return user.username
+
+
+@jwt.user_claims_loader
+def add_claims_to_access_token(user):
+    return {"roles": user.roles}
+
+
+@jwt.additional_headers_loader
+def add_kid_header(user):
+    return {"kid": keyring.signing_key().kid}
+
+
+@jwt.encode_key_loader
+def load_encode_key(user):
+    return keyring.signing_key().signing_key
+
+
+@jwt.decode_key_loader
+def load_decode_key(claims, headers):
+    return keyring.verify_key(headers.get("kid"), headers.get("alg"))
+
+
+@app.route("/api/auth/create_token", methods=["POST"])
+def create_token():
+    username = request.json.get("username", None)
+    password = request.json.get("password", None)
+    user = userid_table.get(username)
+    if user and safe_str_cmp(user.password.encode('utf-8'), password.encode('utf-8')):
+        access_token = create_access_token(identity=user)
+        return jsonify({"access_token": access_token}), 200
+    return jsonify({"msg": "Invalid credentials"})
+
+
+@app.route("/api/users", methods=["GET"])
+@jwt_required
+def list_users():
+    user_list = [user.username for user in users]
+    return jsonify({"type": "+OK", "msg": "success", "users": user_list}), 200
+
+
+#################
+# keyring admin
+#################
+
+@app.cli.command("keyring-generate")
+@click.option("--alg", default="RS256", type=click.Choice(list(KEY_GENERATORS)), help="Key algorithm")
+@click.option("--activate-in", default=0, help="Seconds from now when key starts signing")
+def keyring_generate(alg, activate_in):
+    """Add new key to keyring"""
+    if alg not in supported_algorithms():
+        raise click.ClickException("%s is not supported by installed PyJWT" % alg)
+    path = app.config["JWT_KEYRING_PATH"]
+    keys = KeyRing.read_file(path)
+    data = {"kid": uuid.uuid4().hex[:16], "alg": alg, "activate_at": time.time() + activate_in, "retire_at": None}
+    data.update(KEY_GENERATORS[alg]())
+    keys.append(data)
+    KeyRing.write_file(path, keys)
+    click.echo("Added %s key %s, active at %s" % (alg, data["kid"], time.ctime(data["activate_at"])))
+
+
+@app.cli.command("keyring-retire")
+@click.argument("kid")
+@click.option("--in", "retire_in", default=0, help="Seconds from now when key stops verifying")
+def keyring_retire(kid, retire_in):
+    """Stop accepting tokens signed by key"""
+    path = app.config["JWT_KEYRING_PATH"]
+    keys = KeyRing.read_file(path)
+    for data in keys:
+        if data["kid"] == kid:
+            data["retire_at"] = time.time() + retire_in
+            KeyRing.write_file(path, keys)
+            click.echo("Key %s retires at %s" % (kid, time.ctime(data["retire_at"])))
+            return
+    raise click.ClickException("Unknown key %s" % kid)
+
+
+@app.cli.command("keyring-prune")
+def keyring_prune():
+    """Remove retired keys from keyring"""
+    path = app.config["JWT_KEYRING_PATH"]
+    now = time.time()
+    keys = KeyRing.read_file(path)
+    kept = [data for data in keys if data.get("retire_at") is None or data["retire_at"] > now]
+    KeyRing.write_file(path, kept)
+    click.echo("Removed %d retired keys" % (len(keys) - len(kept)))
+
+
+@app.cli.command("keyring-list")
+def keyring_list():
+    """Show keys in keyring"""
+    for data in KeyRing.read_file(app.config["JWT_KEYRING_PATH"]):
+        click.echo("%s %-6s %-12s active at %s%s" % (
+            data["kid"], data["alg"], "sign+verify" if data.get("private_key") or data.get("secret") else "verify",
+            time.ctime(data["activate_at"]), ", retires at %s" % time.ctime(data["retire_at"])
+            if data.get("retire_at") else ""))
+
+
+@app.cli.command("keyring-export-public")
+@click.argument("output")
+def keyring_export_public(output):
+    """Write keyring without private keys and shared secrets, for verify-only nodes"""
+    keys = [dict((k, v) for k, v in data.items() if k != "private_key")
+            for data in KeyRing.read_file(app.config["JWT_KEYRING_PATH"]) if "secret" not in data]
+    KeyRing.write_file(output, keys)
+    click.echo("Exported %d public keys to %s" % (len(keys), output))
+
+
+@app.cli.command("bench-jwt")
+@click.option("--count", default=2000, help="Number of tokens per algorithm")
+def bench_jwt(count):
+    """Compare issue and verify throughput per algorithm, with cached key objects and with PEM parsed per call"""
+    payload = {"identity": "user1", "user_claims": {"roles": ["role1", "role2"]}, "type": "access", "fresh": False}
+    click.echo("%-6s %14s %14s %16s %16s" % ("alg", "issue/s", "verify/s", "issue/s (pem)", "verify/s (pem)"))
+    for alg in supported_algorithms():
+        data = dict(KEY_GENERATORS[alg](), kid="bench", alg=alg, activate_at=0)
+        key = Key.from_dict(data)
+        signing_pem = data.get("secret") or data["private_key"]
+        verify_pem = data.get("secret") or data["public_key"]
+        rates = []
+        for signing_key, verify_key in ((key.signing_key, key.verify_key), (signing_pem, verify_pem)):
+            start = time.time()
+            tokens = [pyjwt.encode(payload, signing_key, algorithm=alg, headers={"kid": "bench"})
+                      for _ in range(count)]
+            issued = time.time() - start
+            start = time.time()
+            for token in tokens:
+                pyjwt.decode(token, verify_key, algorithms=[alg])
+            verified = time.time() - start
+            rates.extend([count / issued, count / verified])
+        click.echo("%-6s %14.0f %14.0f %16.0f %16.0f" % (alg, rates[0], rates[1], rates[2], rates[3]))
+
+
+if __name__ == "__main__":
+    app.run()
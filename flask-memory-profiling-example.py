@@ -0,0 +1,353 @@
+"""
+flask-memory-profiling-example.py
+
+Requirements:
+ Babel==2.6.0
+ blinker==1.4
+ Click==7.0
+ Flask==1.0.2
+ Flask-BabelEx==0.9.3
+ Flask-Login==0.4.1
+ Flask-Mail==0.9.1
+ Flask-Principal==0.4.0
+ Flask-Security==3.0.0
+ Flask-SQLAlchemy==2.3.2
+ Flask-WTF==0.14.2
+ itsdangerous==1.1.0
+ Jinja2==2.10
+ MarkupSafe==1.1.0
+ passlib==1.7.1
+ pytz==2018.9
+ speaklater==1.3
+ SQLAlchemy==1.2.17
+ Werkzeug==0.14.1
+ WTForms==2.2.1
+
+Usage:
+ - Create admin user using 'FLASK_APP=flask-memory-profiling-example.py flask create-admin admin@example.com <password>'
+ - Run script using 'python flask-memory-profiling-example.py'
+ - Visit below urls
+    - url without login protection 'http://127.0.0.1:5000/marketing'
+    - url with login protection 'http://127.0.0.1:5000/home'
+    - memory report, admin only 'http://127.0.0.1:5000/admin/memory'
+      POST 'action=start', 'action=stop' or 'action=reset' to same url to control profiler
+ - Profile endpoints without running server using
+   'FLASK_APP=flask-memory-profiling-example.py flask memory-profile --requests 500 --path /register --path /marketing'
+
+Notes:
+    - Memory profiler is off by default ('MEMORY_PROFILER_ENABLED = False'). When off, request hooks only check one
+      boolean and tracemalloc is not running, so there is no measurable overhead.
+    - When on, tracemalloc traces all allocations (expect 2-4x slower requests, so enable for diagnosis only).
+        - At teardown of every request, growth of traced memory since request started is added to endpoint's
+          'held_bytes'. It is memory still held by request (forms, identity, session objects) plus anything leaked.
+        - Every 'MEMORY_PROFILER_EVERY'th request of an endpoint is sampled: a snapshot is taken (after gc) just
+          before and just after that request. Growth between them is 'retained_last_sample', memory kept alive after
+          that one request finished, with top 'MEMORY_PROFILER_TOP' allocation sites responsible for it. Requests of
+          other endpoints served between samples are never charged to this endpoint.
+        - First request of an endpoint is never sampled, as it fills one time caches (compiled templates etc.).
+    - Attribution to endpoint is exact only when server handles one request at a time (e.g. 'flask run --without-threads'),
+      as tracemalloc counts allocations of all threads.
+    - Allocations made in this file are excluded from snapshots to hide profiler's own bookkeeping. In a real project
+      keep profiler in its own module and exclude only that module.
+
+References:
+ - https://docs.python.org/3/library/tracemalloc.html
+ - https://pythonhosted.org/Flask-Security/
+"""
+import gc
+import threading
+import tracemalloc
+
+import click
+from flask import Flask, g, jsonify, request
+
+# flask-security
+from flask_security import Security, RoleMixin, UserMixin, login_required, roles_required
+security = Security()
+
+# flask-mail
+from flask_mail import Mail
+mail = Mail()
+
+# database setup
+from flask_sqlalchemy import SQLAlchemy
+db = SQLAlchemy()
+
+
+###################
+# memory profiler
+###################
+
+class MemoryProfiler(object):
+    """Per endpoint allocation tracking using tracemalloc"""
+
+    def __init__(self, app=None):
+        self.active = False
+        self.every = 100
+        self.top = 10
+        self.ignore_endpoints = {"static", "memory_report"}
+        self.stats = {}
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("MEMORY_PROFILER_ENABLED", False)
+        app.config.setdefault("MEMORY_PROFILER_EVERY", 100)
+        app.config.setdefault("MEMORY_PROFILER_TOP", 10)
+        self.every = app.config["MEMORY_PROFILER_EVERY"]
+        self.top = app.config["MEMORY_PROFILER_TOP"]
+        app.before_request(self._before_request)
+        app.teardown_request(self._teardown_request)
+        app.extensions["memory_profiler"] = self
+        if app.config["MEMORY_PROFILER_ENABLED"]:
+            self.start()
+
+    def start(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        self.active = True
+
+    def stop(self):
+        self.active = False
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+    def reset(self):
+        with self._lock:
+            self.stats = {}
+
+    def _before_request(self):
+        if not self.active:
+            return
+        endpoint = request.endpoint or "<unmatched>"
+        if endpoint in self.ignore_endpoints:
+            return
+        with self._lock:
+            stats = self.stats.get(endpoint)
+            if stats is None:
+                stats = self.stats[endpoint] = {"requests": 0, "held_bytes": 0, "window": 0, "samples": 0,
+                                                "sample_bytes": 0, "top": []}
+            stats["window"] += 1
+            sample = stats["window"] >= self.every and stats["requests"] > 0
+            if sample:
+                stats["window"] = 0
+        g._memory_profiler_endpoint = endpoint
+        g._memory_profiler_snapshot = self._snapshot() if sample else None
+        g._memory_profiler_start = tracemalloc.get_traced_memory()[0]
+
+    def _teardown_request(self, exc=None):
+        if not self.active:
+            return
+        start = g.pop("_memory_profiler_start", None)
+        before = g.pop("_memory_profiler_snapshot", None)
+        endpoint = g.pop("_memory_profiler_endpoint", None)
+        if start is None:
+            return
+        held = tracemalloc.get_traced_memory()[0] - start
+        with self._lock:
+            stats = self.stats.get(endpoint)
+            if stats is None:
+                # reset while request was running
+                return
+            stats["requests"] += 1
+            stats["held_bytes"] += held
+        if before is not None:
+            self._compare(stats, before, self._snapshot())
+
+    @staticmethod
+    def _snapshot():
+        gc.collect()
+        return tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            # profiler's own bookkeeping
+            tracemalloc.Filter(False, __file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            tracemalloc.Filter(False, "<unknown>"),
+        ))
+
+    def _compare(self, stats, before, after):
+        diff = after.compare_to(before, "lineno")
+        stats["samples"] += 1
+        stats["sample_bytes"] = sum(stat.size_diff for stat in diff)
+        stats["top"] = [{"site": str(stat.traceback[0]), "size_diff": stat.size_diff, "count_diff": stat.count_diff}
+                        for stat in diff[:self.top] if stat.size_diff > 0]
+
+    def report(self):
+        """Return per endpoint stats, endpoint retaining most memory first"""
+        with self._lock:
+            items = sorted(self.stats.items(), key=lambda item: item[1]["sample_bytes"], reverse=True)
+            return [{
+                "endpoint": endpoint,
+                "requests": stats["requests"],
+                "held_per_request": stats["held_bytes"] / float(stats["requests"] or 1),
+                "samples": stats["samples"],
+                "retained_last_sample": stats["sample_bytes"],
+                "top": stats["top"],
+            } for endpoint, stats in items]
+
+
+memory_profiler = MemoryProfiler()
+
+
+##################
+# database models
+##################
+
+from sqlalchemy.sql import func
+roles_users = db.Table("roles_users",
+                       db.Column("user_id", db.Integer(), db.ForeignKey("user.id")),
+                       db.Column("role_id", db.Integer(), db.ForeignKey("role.id")))
+
+
+class Role(db.Model, RoleMixin):
+    id = db.Column(db.Integer, primary_key=True)
+    date_created = db.Column(db.DateTime, server_default=func.now())
+    date_modified = db.Column(db.DateTime, onupdate=func.now())
+    name = db.Column(db.String(80), unique=True)
+    description = db.Column(db.String(255))
+
+
+class User(db.Model, UserMixin):
+    id = db.Column(db.Integer, primary_key=True)
+    date_created = db.Column(db.DateTime, server_default=func.now())
+    date_modified = db.Column(db.DateTime, onupdate=func.now())
+    email = db.Column(db.String(255), unique=True)
+    password = db.Column(db.String(255))
+    active = db.Column(db.Boolean())
+    confirmed_at = db.Column(db.DateTime())
+    roles = db.relationship("Role", secondary=roles_users, backref=db.backref("users", lazy="dynamic"))
+
+
+####################
+# customized forms
+####################
+
+from flask_security.forms import RegisterForm, ConfirmRegisterForm
+from wtforms import StringField
+from wtforms.validators import InputRequired, Length
+
+
+class ExtendedRegisterForm(RegisterForm):
+    first_name = StringField("First Name", validators=[InputRequired(), Length(max=32)])
+    last_name = StringField("Last Name", validators=[InputRequired(), Length(max=32)])
+
+
+class ExtendedConfirmRegisterForm(ConfirmRegisterForm):
+    first_name = StringField("First Name", validators=[InputRequired(), Length(max=32)])
+    last_name = StringField("Last Name", validators=[InputRequired(), Length(max=32)])
+
+
+################################################################################################
+# configuration (Do NOT commit passwords/secrets. See skeleton example to handle them securely)
+################################################################################################
+
+class Config(object):
+    # sqlalchemy
+    SQLALCHEMY_DATABASE_URI = "sqlite:///temp.sqlite3"
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+    SECRET_KEY = "<my-secret-key>"
+    # flask-security
+    SECURITY_PASSWORD_HASH = "bcrypt"
+    SECURITY_PASSWORD_SALT = "<my-random-hash>"
+    SECURITY_REGISTERABLE = True
+    SECURITY_CONFIRMABLE = True
+    SECURITY_CHANGABLE = True
+    SECURITY_RECOVERABLE = True
+    # flask-mail - if using gmail, make sure to enable access for less secure apps, from google security settings
+    MAIL_SERVER = "smtp.gmail.com"
+    MAIL_PORT = 587
+    MAIL_USE_TLS = True
+    MAIL_USERNAME = ""
+    MAIL_PASSWORD = ""
+    # memory profiler
+    MEMORY_PROFILER_ENABLED = False
+    MEMORY_PROFILER_EVERY = 100
+    MEMORY_PROFILER_TOP = 10
+
+
+#######################
+# application factory
+#######################
+
+def create_app():
+    app = Flask(__name__)
+    app.config.from_object(Config)
+
+    mail.init_app(app)
+    from flask_security import SQLAlchemyUserDatastore
+    user_datastore = SQLAlchemyUserDatastore(db, User, Role)
+    security.init_app(app, user_datastore, register_form=ExtendedRegisterForm, confirm_register_form=ExtendedConfirmRegisterForm)
+    db.init_app(app)
+    memory_profiler.init_app(app)
+
+    with app.app_context():
+        db.create_all()
+
+        @app.route("/home")
+        @login_required
+        def home():
+            return "<h3> Secured Sweet Home where no worries !!!! <h3>"
+
+        @app.route("/marketing")
+        def test():
+            return "<h3> Marketing page open to all <h3>"
+
+        @app.route("/admin/memory", endpoint="memory_report", methods=["GET", "POST"])
+        @roles_required("admin")
+        def memory_report():
+            """Show memory profiler report. POST action=start|stop|reset to control profiler"""
+            if request.method == "POST":
+                action = request.form.get("action")
+                if action == "start":
+                    memory_profiler.start()
+                elif action == "stop":
+                    memory_profiler.stop()
+                elif action == "reset":
+                    memory_profiler.reset()
+                else:
+                    return jsonify({"msg": "Unknown action"}), 400
+            return jsonify({"active": memory_profiler.active, "every": memory_profiler.every,
+                            "endpoints": memory_profiler.report()})
+
+    @app.cli.command("create-admin")
+    @click.argument("email")
+    @click.argument("password")
+    def create_admin(email, password):
+        """Create confirmed user with admin role"""
+        from datetime import datetime
+        from flask_security.utils import hash_password
+        role = user_datastore.find_or_create_role("admin")
+        user = user_datastore.create_user(email=email, password=hash_password(password), confirmed_at=datetime.utcnow())
+        user_datastore.add_role_to_user(user, role)
+        db.session.commit()
+        click.echo("Admin created | %s" % email)
+
+    @app.cli.command("memory-profile")
+    @click.option("--requests", "count", default=500, help="Number of requests per path")
+    @click.option("--path", "paths", multiple=True, default=["/marketing", "/register", "/login"], help="Path to request")
+    def memory_profile(count, paths):
+        """Request given paths with profiler on and print top allocation sites per endpoint"""
+        app.config["WTF_CSRF_ENABLED"] = False
+        memory_profiler.reset()
+        memory_profiler.start()
+        client = app.test_client()
+        # one path at a time, so a path's requests run back to back
+        for path in paths:
+            for _ in range(count):
+                client.get(path)
+        report = memory_profiler.report()
+        memory_profiler.stop()
+        for stats in report:
+            click.echo("\n%s | %d requests | held %.1f bytes per request | %d sampled, last one retained %d bytes" % (
+                stats["endpoint"], stats["requests"], stats["held_per_request"], stats["samples"],
+                stats["retained_last_sample"]))
+            for site in stats["top"]:
+                click.echo("    %+10d B %+7d blocks  %s" % (site["size_diff"], site["count_diff"], site["site"]))
+
+    return app
+
+
+if __name__ == "__main__":
+    app = create_app()
+    app.run()
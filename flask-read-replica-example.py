@@ -0,0 +1,343 @@
+"""
+flask-read-replica-example.py
+
+Requirements:
+ Click==7.0
+ Flask==1.0.2
+ Flask-Admin==1.5.3
+ Flask-SQLAlchemy==2.3.2
+ itsdangerous==1.1.0
+ Jinja2==2.10
+ MarkupSafe==1.1.0
+ SQLAlchemy==1.2.17
+ Werkzeug==0.14.1
+ WTForms==2.2.1
+
+Usage:
+ - Run script using 'python flask-read-replica-example.py'
+ - Visit below urls
+    - admin 'http://127.0.0.1:5000/admin' (list views read from replicas, create/edit/delete write to primary)
+    - user list api 'http://127.0.0.1:5000/api/users' (reads from replica)
+    - create user by sending POST request to 'http://127.0.0.1:5000/api/users' with body {"username": <username>}
+    - routing status 'http://127.0.0.1:5000/api/db-routing'
+ - Copy primary to replicas manually using 'FLASK_APP=flask-read-replica-example.py flask refresh-replicas'
+
+Notes:
+    - 'SQLALCHEMY_DATABASE_URI' is primary. Replicas are ordinary flask-sqlalchemy binds listed in 'REPLICA_BINDS'.
+    - 'db' is still one shared instance, but its session picks engine per statement
+        - flushes, and any statement while session has pending changes, go to primary.
+        - reads in views decorated with '@read_from_replica' go to a healthy replica (round robin per request).
+          Replica is picked once per request, so all queries of a request (like count and rows of a list page)
+          see same data. Flask-admin list views and GET api views use it. Everything else reads from primary.
+        - after a request writes, rest of that request reads from primary.
+        - read-your-writes: after a request writes, same client reads from primary for
+          'REPLICA_READ_YOUR_WRITES' seconds (tracked in flask session), so it never sees its own write missing.
+    - Staleness: primary updates 'replica_heartbeat' row every refresh. Router reads that row from each replica
+      (at most every 'REPLICA_CHECK_INTERVAL' seconds, by one request while others keep using last result).
+      Replica older than 'REPLICA_MAX_LAG' seconds, or failing, is skipped. If no replica is healthy, reads fall
+      back to primary.
+    - For local testing, replicas are sqlite files refreshed from primary every 'REPLICA_REFRESH_INTERVAL' seconds
+      by a background thread using sqlite backup api. With real replicas set 'REPLICA_REFRESH_INTERVAL = 0' and keep
+      updating heartbeat on primary.
+
+References:
+ - https://flask-sqlalchemy.palletsprojects.com/en/2.x/binds/
+ - https://docs.sqlalchemy.org/en/latest/orm/persistence_techniques.html#custom-vertical-partitioning
+ - https://docs.python.org/3/library/sqlite3.html#sqlite3.Connection.backup
+"""
+import functools
+import itertools
+import threading
+import time
+
+import click
+from flask import Flask, g, has_request_context, jsonify, request, session
+from flask_admin import Admin, expose
+from flask_admin.contrib.sqla import ModelView
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import event, orm
+
+
+##################
+# session routing
+##################
+
+class ReplicaRouter(object):
+    """Tracks replica health and picks engine for reads"""
+
+    def __init__(self, app=None):
+        self.app = None
+        self.replicas = []
+        self.health = {}
+        self.reads = {}
+        self._next_check = 0
+        self._cycle = None
+        self._lock = threading.Lock()
+        self._check_lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("REPLICA_BINDS", [])
+        app.config.setdefault("REPLICA_MAX_LAG", 10)
+        app.config.setdefault("REPLICA_CHECK_INTERVAL", 1)
+        app.config.setdefault("REPLICA_READ_YOUR_WRITES", 5)
+        app.config.setdefault("REPLICA_REFRESH_INTERVAL", 2)
+        self.app = app
+        self.replicas = list(app.config["REPLICA_BINDS"])
+        self.health = {name: {"healthy": False, "lag": None, "error": None} for name in self.replicas}
+        self.reads = dict.fromkeys(["primary"] + self.replicas, 0)
+        self._cycle = itertools.cycle(self.replicas)
+        app.extensions["replica_router"] = self
+        app.after_request(self._remember_writes)
+
+    def check(self, force=False):
+        """
+        Read heartbeat from every replica and mark it healthy if it is fresh.
+        Only one thread checks at a time, others keep using current health instead of waiting (unless forced).
+        """
+        now = time.time()
+        if not force and now < self._next_check:
+            return
+        if not self._check_lock.acquire(force):
+            return
+        try:
+            self._next_check = now + self.app.config["REPLICA_CHECK_INTERVAL"]
+            health = {}
+            for name in self.replicas:
+                try:
+                    beat_at = db.get_engine(self.app, bind=name).execute(
+                        "SELECT beat_at FROM replica_heartbeat WHERE id = 1").scalar()
+                    lag = now - beat_at if beat_at is not None else None
+                    healthy = lag is not None and lag <= self.app.config["REPLICA_MAX_LAG"]
+                    health[name] = {"healthy": healthy, "lag": lag, "error": None}
+                except Exception as e:
+                    health[name] = {"healthy": False, "lag": None, "error": str(e)}
+            self.health = health
+        finally:
+            self._check_lock.release()
+
+    def choose(self):
+        """Return bind name of healthy replica, or None to use primary. Same answer for whole request"""
+        if not self.replicas or not has_request_context() or not g.get("_read_from_replica"):
+            return None
+        if "_replica" in g:
+            return g._replica
+        name = None
+        if session.get("_primary_until", 0) <= time.time():
+            self.check()
+            health = self.health
+            with self._lock:
+                for _ in range(len(self.replicas)):
+                    candidate = next(self._cycle)
+                    if health[candidate]["healthy"]:
+                        name = candidate
+                        break
+        g._replica = name
+        return name
+
+    def _remember_writes(self, response):
+        if g.get("_db_wrote"):
+            session["_primary_until"] = time.time() + self.app.config["REPLICA_READ_YOUR_WRITES"]
+        return response
+
+
+router = ReplicaRouter()
+
+
+class RoutingSession(SignallingSession):
+    """Session sending writes to primary and, where allowed, reads to a replica"""
+
+    def get_bind(self, mapper=None, clause=None):
+        if not self._flushing and not (self.new or self.dirty or self.deleted):
+            name = router.choose()
+            if name is not None:
+                router.reads[name] += 1
+                return db.get_engine(self.app, bind=name)
+        router.reads["primary"] += 1
+        return super(RoutingSession, self).get_bind(mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+def read_from_replica(func):
+    """Allow reads of decorated view to go to replicas"""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        g._read_from_replica = True
+        return func(*args, **kwargs)
+    return wrapper
+
+
+# database setup
+db = RoutingSQLAlchemy()
+
+
+@event.listens_for(RoutingSession, "after_flush")
+def mark_write(db_session, flush_context):
+    if has_request_context():
+        g._db_wrote = True
+        # rest of request reads its own write from primary
+        g._replica = None
+
+
+###################
+# replica refresh
+###################
+
+def refresh_replicas(app):
+    """Bump heartbeat on primary and copy primary to every replica using sqlite backup api"""
+    primary = db.get_engine(app)
+    with primary.begin() as conn:
+        conn.execute("INSERT OR REPLACE INTO replica_heartbeat (id, beat_at) VALUES (1, ?)", (time.time(),))
+    # pooled dbapi connections, so in memory primary (one connection per thread) is copied too
+    source = primary.raw_connection()
+    try:
+        for name in app.config["REPLICA_BINDS"]:
+            target = db.get_engine(app, bind=name).raw_connection()
+            try:
+                source.connection.backup(target.connection)
+            finally:
+                target.close()
+    finally:
+        source.close()
+
+
+def start_replica_refresher(app):
+    interval = app.config["REPLICA_REFRESH_INTERVAL"]
+    if not interval:
+        return None
+
+    def run():
+        while True:
+            time.sleep(interval)
+            try:
+                with app.app_context():
+                    refresh_replicas(app)
+            except Exception:
+                app.logger.exception("Replica refresh failed")
+
+    thread = threading.Thread(target=run, name="replica-refresher")
+    thread.daemon = True
+    thread.start()
+    return thread
+
+
+##################
+# database models
+##################
+
+from sqlalchemy.sql import func
+class User(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    date_created = db.Column(db.DateTime, server_default=func.now())
+    date_modified = db.Column(db.DateTime, onupdate=func.now())
+    username = db.Column(db.String(32), nullable=False, unique=True)
+    posts = db.relationship("Post", backref="user", lazy=True)
+
+    def __repr__(self):
+        return "<%s>" % self.username
+
+
+class Post(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    date_created = db.Column(db.DateTime, server_default=func.now())
+    date_modified = db.Column(db.DateTime, onupdate=func.now())
+    author_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False)
+    title = db.Column(db.String(32), nullable=False)
+    text = db.Column(db.Text)
+
+    def __repr__(self):
+        return "<%s>" % self.title
+
+
+class ReplicaHeartbeat(db.Model):
+    """Single row, updated on primary. Its age on replica is replica lag"""
+    __tablename__ = "replica_heartbeat"
+    id = db.Column(db.Integer, primary_key=True)
+    beat_at = db.Column(db.Float, nullable=False)
+
+
+##############
+# admin views
+##############
+
+class ReplicaModelView(ModelView):
+    """Model view whose list page reads from replicas"""
+
+    @expose("/")
+    @read_from_replica
+    def index_view(self):
+        return super(ReplicaModelView, self).index_view()
+
+
+class Config(object):
+    SQLALCHEMY_DATABASE_URI = "sqlite:///temp.sqlite3"
+    SQLALCHEMY_BINDS = {
+        "replica1": "sqlite:///temp-replica1.sqlite3",
+        "replica2": "sqlite:///temp-replica2.sqlite3",
+    }
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+    SECRET_KEY = "<my-secret-key>"
+    FLASK_ADMIN_SWATCH = "cerulean"
+    # replicas
+    REPLICA_BINDS = ["replica1", "replica2"]
+    REPLICA_MAX_LAG = 10
+    REPLICA_CHECK_INTERVAL = 1
+    REPLICA_READ_YOUR_WRITES = 5
+    REPLICA_REFRESH_INTERVAL = 2
+
+
+def create_app():
+    # init flask app
+    app = Flask(__name__)
+    app.config.from_object(Config)
+
+    db.init_app(app)
+    router.init_app(app)
+
+    with app.app_context():
+        # init admin
+        admin = Admin(app, name="microblog", template_mode="bootstrap3")
+        admin.add_view(ReplicaModelView(User, db.session))
+        admin.add_view(ReplicaModelView(Post, db.session))
+
+        # create tables on primary and copy them to replicas
+        db.create_all()
+        if app.config["REPLICA_REFRESH_INTERVAL"]:
+            refresh_replicas(app)
+
+    @app.route("/api/users", methods=["GET"])
+    @read_from_replica
+    def list_users():
+        user_list = [user.username for user in User.query.order_by(User.id)]
+        return jsonify({"type": "+OK", "msg": "success", "users": user_list}), 200
+
+    @app.route("/api/users", methods=["POST"])
+    def create_user():
+        user = User(username=request.json.get("username"))
+        db.session.add(user)
+        db.session.commit()
+        return jsonify({"type": "+OK", "msg": "success", "id": user.id}), 201
+
+    @app.route("/api/db-routing", methods=["GET"])
+    def db_routing():
+        router.check(force=True)
+        return jsonify({"replicas": router.health, "reads": router.reads})
+
+    @app.cli.command("refresh-replicas")
+    def refresh_replicas_command():
+        """Copy primary database to all replicas"""
+        refresh_replicas(app)
+        click.echo("Refreshed %s" % ", ".join(app.config["REPLICA_BINDS"]))
+
+    start_replica_refresher(app)
+    return app
+
+
+if __name__ == "__main__":
+    app = create_app()
+    app.run()
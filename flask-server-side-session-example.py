@@ -0,0 +1,621 @@
+"""
+flask-server-side-session-example.py
+
+Requirements:
+ Click==7.0
+ Flask==1.0.2
+ Flask-Login==0.4.1
+ Flask-SQLAlchemy==2.3.2
+ Flask-WTF==0.14.2
+ itsdangerous==1.1.0
+ Jinja2==2.10
+ MarkupSafe==1.1.0
+ SQLAlchemy==1.2.17
+ Werkzeug==0.14.1
+ WTForms==2.2.1
+
+Usage:
+ - Run script using 'python flask-server-side-session-example.py'
+ - Visit below urls
+    - url without login protection 'http://127.0.0.1:5000/marketing'
+    - url with login protection 'http://127.0.0.1:5000/home'
+ - Compare cookie size and per request overhead with default cookie session using
+   'FLASK_APP=flask-server-side-session-example.py flask bench-session --requests 1000'
+
+Notes:
+    - By default flask keeps whole session (flask-login '_user_id', '_fresh', '_id', csrf token, flashed messages)
+      in a signed cookie, which is serialized, signed and sent on every response which modifies it and is sent
+      back by browser on every request.
+    - Here cookie only carries a random session id signed with 'SECRET_KEY'. Session data lives in a store.
+        - 'SESSION_TYPE = "memory"' - in process LRU store. Fine for single process/development.
+        - 'SESSION_TYPE = "sqlite"' - sqlite table with index on expiry. Expired rows are deleted in batches
+          every 'SESSION_GC_INTERVAL' seconds, so no request pays for full table scan.
+        - 'SESSION_TYPE = "cookie"' - flask default, kept for comparison.
+    - Session data is encoded with flask's tagged json serializer and zlib compressed when it is large.
+    - Session is written to store only when it is modified (dirty). Unmodified sessions only refresh their store
+      expiry once half of 'PERMANENT_SESSION_LIFETIME' has passed, so active sessions never expire in store.
+      Cookie is resent on refresh only for permanent sessions, non permanent cookie lasts till browser closes.
+    - Session id is regenerated whenever logged in user changes (login, logout), and old row is deleted from store.
+      So a session id planted in browser before login (session fixation) is useless after login.
+
+References:
+ - http://flask.pocoo.org/docs/1.0/api/#session-interface
+ - http://flask.pocoo.org/snippets/category/sessions/
+ - https://flask-login.readthedocs.io/en/latest/
+"""
+import re
+import sqlite3
+import threading
+import time
+import uuid
+import zlib
+from collections import OrderedDict
+
+import click
+from flask import Flask, flash, redirect, render_template_string, url_for, request, session
+from flask.sessions import SessionInterface, SessionMixin, SecureCookieSessionInterface, session_json_serializer
+from itsdangerous import Signer, BadSignature, want_bytes
+from werkzeug.datastructures import CallbackDict
+from werkzeug.security import generate_password_hash, check_password_hash
+
+# flask-sqlalchemy setup
+from flask_sqlalchemy import SQLAlchemy
+db = SQLAlchemy()
+
+# flask-login setup
+from flask_login import LoginManager, current_user, login_required, login_user, logout_user, user_logged_in, \
+    user_logged_out
+login_manager = LoginManager()
+
+# csrf setup
+from flask_wtf.csrf import CSRFProtect
+csrf = CSRFProtect()
+
+
+###################
+# session encoding
+###################
+
+COMPRESS_THRESHOLD = 256
+
+
+def encode_session(data):
+    """Encode session dict to compact bytes. Large payloads are zlib compressed"""
+    raw = want_bytes(session_json_serializer.dumps(data))
+    if len(raw) > COMPRESS_THRESHOLD:
+        return b"z" + zlib.compress(raw)
+    return b"j" + raw
+
+
+def decode_session(value):
+    if value[:1] == b"z":
+        return session_json_serializer.loads(zlib.decompress(value[1:]).decode("utf-8"))
+    return session_json_serializer.loads(value[1:].decode("utf-8"))
+
+
+#################
+# session stores
+#################
+
+class MemoryStore(object):
+    """In process LRU store. Least recently used sessions are dropped once 'max_entries' is reached"""
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, sid):
+        with self._lock:
+            item = self._data.get(sid)
+            if item is None:
+                return None
+            if item[1] < time.time():
+                del self._data[sid]
+                return None
+            self._data.move_to_end(sid)
+            return item
+
+    def set(self, sid, value, expires):
+        with self._lock:
+            self._data[sid] = (value, expires)
+            self._data.move_to_end(sid)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def touch(self, sid, expires):
+        with self._lock:
+            item = self._data.get(sid)
+            if item is not None:
+                self._data[sid] = (item[0], expires)
+
+    def delete(self, sid):
+        with self._lock:
+            self._data.pop(sid, None)
+
+
+class SQLiteStore(object):
+    """
+    Sqlite backed store. One connection per thread.
+    Expired sessions are removed in batches of 'gc_batch_size' at most once per 'gc_interval' seconds.
+    """
+
+    def __init__(self, path, gc_interval=60, gc_batch_size=500):
+        self.path = path
+        self.gc_interval = gc_interval
+        self.gc_batch_size = gc_batch_size
+        self._local = threading.local()
+        self._next_gc = 0
+        conn = self._connection()
+        conn.execute("CREATE TABLE IF NOT EXISTS session (sid TEXT PRIMARY KEY, data BLOB, expires REAL)")
+        conn.execute("CREATE INDEX IF NOT EXISTS ix_session_expires ON session (expires)")
+        conn.commit()
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, sid):
+        row = self._connection().execute("SELECT data, expires FROM session WHERE sid = ? AND expires >= ?",
+                                         (sid, time.time())).fetchone()
+        return row
+
+    def set(self, sid, value, expires):
+        conn = self._connection()
+        conn.execute("INSERT OR REPLACE INTO session (sid, data, expires) VALUES (?, ?, ?)",
+                     (sid, sqlite3.Binary(value), expires))
+        conn.commit()
+        self.maybe_gc()
+
+    def touch(self, sid, expires):
+        conn = self._connection()
+        conn.execute("UPDATE session SET expires = ? WHERE sid = ?", (expires, sid))
+        conn.commit()
+
+    def delete(self, sid):
+        conn = self._connection()
+        conn.execute("DELETE FROM session WHERE sid = ?", (sid,))
+        conn.commit()
+
+    def maybe_gc(self):
+        now = time.time()
+        if now < self._next_gc:
+            return 0
+        self._next_gc = now + self.gc_interval
+        return self.gc(now)
+
+    def gc(self, now=None):
+        """Delete expired sessions in batches. Return number of deleted sessions"""
+        now = time.time() if now is None else now
+        conn = self._connection()
+        deleted = 0
+        while True:
+            cursor = conn.execute("DELETE FROM session WHERE sid IN "
+                                  "(SELECT sid FROM session WHERE expires < ? LIMIT ?)", (now, self.gc_batch_size))
+            conn.commit()
+            deleted += cursor.rowcount
+            if cursor.rowcount < self.gc_batch_size:
+                return deleted
+
+
+####################
+# session interface
+####################
+
+class ServerSideSession(CallbackDict, SessionMixin):
+    """Session whose data is kept in store. Only 'sid' goes to cookie"""
+
+    def __init__(self, initial=None, sid=None, new=False, expires=None, interface=None):
+        def on_update(self):
+            self.modified = True
+            self.accessed = True
+
+        super(ServerSideSession, self).__init__(initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.expires = expires
+        self.interface = interface
+        self.modified = False
+        self.accessed = False
+
+    def regenerate(self):
+        """Move session data to new session id and delete old one from store"""
+        if not self.new:
+            self.interface.store.delete(self.sid)
+        self.sid = self.interface.generate_sid()
+        self.new = True
+        self.modified = True
+
+    def __getitem__(self, key):
+        self.accessed = True
+        return super(ServerSideSession, self).__getitem__(key)
+
+    def get(self, key, default=None):
+        self.accessed = True
+        return super(ServerSideSession, self).get(key, default)
+
+    def setdefault(self, key, default=None):
+        self.accessed = True
+        return super(ServerSideSession, self).setdefault(key, default)
+
+
+class ServerSideSessionInterface(SessionInterface):
+    session_class = ServerSideSession
+
+    def __init__(self, store):
+        self.store = store
+
+    @staticmethod
+    def generate_sid():
+        return uuid.uuid4().hex
+
+    def get_signer(self, app):
+        if not app.secret_key:
+            return None
+        return Signer(app.secret_key, salt="server-side-session")
+
+    def open_session(self, app, request):
+        signer = self.get_signer(app)
+        if signer is None:
+            return None
+        val = request.cookies.get(app.session_cookie_name)
+        if val:
+            try:
+                sid = signer.unsign(val).decode("utf-8")
+            except BadSignature:
+                sid = None
+            if sid:
+                item = self.store.get(sid)
+                if item is not None:
+                    data, expires = item
+                    return self.session_class(decode_session(bytes(data)), sid=sid, expires=expires, interface=self)
+        return self.session_class(sid=self.generate_sid(), new=True, interface=self)
+
+    def _lifetime(self, app):
+        return app.permanent_session_lifetime.total_seconds()
+
+    def save_session(self, app, session, response):
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        # If the session is modified to be empty, remove it from store and remove the cookie.
+        if not session:
+            if session.modified:
+                if not session.new:
+                    self.store.delete(session.sid)
+                response.delete_cookie(app.session_cookie_name, domain=domain, path=path)
+            return
+
+        if session.accessed:
+            response.vary.add("Cookie")
+
+        now = time.time()
+        lifetime = self._lifetime(app)
+        if session.modified or session.new:
+            session.expires = now + lifetime
+            self.store.set(session.sid, encode_session(dict(session)), session.expires)
+        elif session.expires - now < lifetime / 2 \
+                and (not session.permanent or app.config["SESSION_REFRESH_EACH_REQUEST"]):
+            session.expires = now + lifetime
+            self.store.touch(session.sid, session.expires)
+            if not session.permanent:
+                return
+        else:
+            return
+
+        response.set_cookie(
+            app.session_cookie_name,
+            self.get_signer(app).sign(want_bytes(session.sid)).decode("utf-8"),
+            expires=self.get_expiration_time(app, session),
+            httponly=self.get_cookie_httponly(app),
+            domain=domain,
+            path=path,
+            secure=self.get_cookie_secure(app),
+            samesite=self.get_cookie_samesite(app),
+        )
+
+
+class ServerSideSessionExtension(object):
+    """Install session interface based on 'SESSION_TYPE' config"""
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("SESSION_TYPE", "memory")
+        app.config.setdefault("SESSION_MEMORY_MAX_ENTRIES", 10000)
+        app.config.setdefault("SESSION_SQLITE_PATH", "sessions.sqlite3")
+        app.config.setdefault("SESSION_GC_INTERVAL", 60)
+        app.config.setdefault("SESSION_GC_BATCH_SIZE", 500)
+
+        session_type = app.config["SESSION_TYPE"]
+        if session_type == "cookie":
+            app.session_interface = SecureCookieSessionInterface()
+            return
+        if session_type == "memory":
+            store = MemoryStore(app.config["SESSION_MEMORY_MAX_ENTRIES"])
+        elif session_type == "sqlite":
+            store = SQLiteStore(app.config["SESSION_SQLITE_PATH"], gc_interval=app.config["SESSION_GC_INTERVAL"],
+                                gc_batch_size=app.config["SESSION_GC_BATCH_SIZE"])
+        else:
+            raise ValueError("Unknown SESSION_TYPE %r" % session_type)
+        app.session_interface = ServerSideSessionInterface(store)
+
+
+server_side_session = ServerSideSessionExtension()
+
+
+@user_logged_in.connect
+@user_logged_out.connect
+def regenerate_session(app, **kwargs):
+    """New session id on every login/logout, against session fixation"""
+    if isinstance(session._get_current_object(), ServerSideSession):
+        session.regenerate()
+
+
+##################
+# database models
+##################
+
+from flask_login import UserMixin
+from sqlalchemy.sql import func
+
+
+class User(db.Model, UserMixin):
+    id = db.Column(db.Integer, primary_key=True)
+    date_created = db.Column(db.DateTime, server_default=func.now())
+    date_modified = db.Column(db.DateTime, onupdate=func.now())
+    email = db.Column(db.String(255), unique=True)
+    password = db.Column(db.String(255))
+    first_name = db.Column(db.String(255))
+    last_name = db.Column(db.String(255))
+
+
+####################
+# login forms
+####################
+
+from flask_wtf.form import FlaskForm
+from wtforms import StringField, PasswordField
+from wtforms.fields.html5 import EmailField
+from wtforms.validators import Email, Length, InputRequired, ValidationError
+
+
+class RegisterForm(FlaskForm):
+    first_name = StringField("First Name", validators=[InputRequired(), Length(max=32)])
+    last_name = StringField("Last Name", validators=[InputRequired(), Length(max=32)])
+    email = EmailField("Email", validators=[InputRequired(), Email()])
+    password = PasswordField("Password", validators=[InputRequired(), Length(min=5, max=32)])
+
+    def validate_email(self, email):
+        user = User.query.filter_by(email=email.data).first()
+        if user is not None:
+            raise ValidationError("Please use a different email")
+
+
+class LoginForm(FlaskForm):
+    email = EmailField("Email", validators=[InputRequired(), Email()])
+    password = PasswordField("Password", validators=[InputRequired(), Length(min=5, max=32)])
+
+
+####################
+# Sample templates
+###################
+
+register_template = """
+<form method="post" action="{{ url_for('register') }}">
+    {{ form.csrf_token }}
+  <h1>Sign up</h1>
+        {% with messages = get_flashed_messages() %}
+        {% if messages %}
+        {% for message in messages %}
+                {{ message }}
+        {% endfor %}
+        {% endif %}
+        {% endwith %}
+
+    <p><input type="text"  name="first_name" placeholder="First Name" required autofocus></p>
+    <p><input type="text" name="last_name" placeholder="Last Name" required autofocus></p>
+    <p><input type="text" name="email" placeholder="email" required autofocus></p>
+    <p><input type="password" name="password" placeholder="password" required></p>
+    <p><button type="submit">Register</button></p>
+    <p><a href="{{ url_for('login') }}">Already have account ?</a></p>
+</form>
+"""
+
+login_template = """
+<form method="post" action="{{ url_for('login') }}">
+    {{ form.csrf_token }}
+        <h1> Login </h1>
+        {% with messages = get_flashed_messages() %}
+        {% if messages %}
+        {% for message in messages %}
+           {{ message }}
+        {% endfor %}
+        {% endif %}
+        {% endwith %}
+
+    <p><input type="text" name="email" placeholder="email" required autofocus></p>
+    <p><input type="password" name="password" placeholder="password" required></p>
+    <p><button class="btn btn-lg btn-primary btn-block" type="submit">Sign in</button></p>
+    <p><a href="{{ url_for('register') }}">Not registered ?</a></p>
+</form>
+"""
+
+home_template = """
+<h3> Secured Sweet Home where no worries !!!! <h3>
+<p><a href="{{ url_for('logout') }}">Logout</a></p>
+"""
+
+
+##########
+# Helpers
+##########
+
+def flash_errors(form):
+    """Generate flashes form errors"""
+    for field, errors in form.errors.items():
+        for error in errors:
+            flash(u"Error in the %s field - %s" % (
+                getattr(form, field).label.text,
+                error
+            ), 'error')
+
+
+################################################################################################
+# configuration (Do NOT commit passwords/secrets. See skeleton example to handle them securely)
+################################################################################################
+
+class Config(object):
+    # sqlalchemy
+    SQLALCHEMY_DATABASE_URI = "sqlite:///temp.sqlite3"
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+    SECRET_KEY = "<my-secret-key>"
+    # server side session - "memory", "sqlite" or "cookie"
+    SESSION_TYPE = "sqlite"
+    SESSION_SQLITE_PATH = "sessions.sqlite3"
+    SESSION_MEMORY_MAX_ENTRIES = 10000
+    SESSION_GC_INTERVAL = 60
+    SESSION_GC_BATCH_SIZE = 500
+
+
+#######################
+# application factory
+#######################
+
+def create_app(config=Config):
+    app = Flask(__name__)
+    app.config.from_object(config)
+
+    # initialize extensions
+    server_side_session.init_app(app)
+    csrf.init_app(app)
+    login_manager.init_app(app)
+    login_manager.login_view = "login"
+    db.init_app(app)
+
+    with app.app_context():
+        db.create_all()
+
+        ##############
+        # Controllers
+        ##############
+
+        @login_manager.user_loader
+        def load_user(id):
+            return User.query.get(int(id))
+
+        @app.route("/register", endpoint="register", methods=["GET", "POST"])
+        def register():
+            """Handle register request"""
+            if current_user.is_authenticated:
+                return redirect(url_for('home'))
+            form = RegisterForm(request.form)
+            if request.method == "POST" and form.validate_on_submit():
+                password = generate_password_hash(form.password.data, method="sha256")
+                user = User(first_name=form.first_name.data, last_name=form.last_name.data, email=form.email.data,
+                            password=password)
+                db.session.add(user)
+                db.session.commit()
+                login_user(user)
+                app.logger.info("New user registered successfully using form | %s" % user.email)
+                return redirect(url_for("home"))
+            else:
+                flash_errors(form)
+            return render_template_string(register_template, form=form)
+
+        @app.route("/login", endpoint="login", methods=["GET", "POST"])
+        def login():
+            """Handle login request."""
+            if current_user.is_authenticated:
+                return redirect(url_for("home"))
+            form = LoginForm(request.form)
+            if request.method == "POST" and form.validate():
+                user = User.query.filter_by(email=form.email.data).first()
+                if user is None or not check_password_hash(user.password, form.password.data):
+                    flash("Invalid username/password")
+                    return render_template_string(login_template, form=form)
+                login_user(user)
+                app.logger.debug("User login successful | %s" % user.email)
+                return redirect(url_for("home"))
+            else:
+                flash_errors(form)
+            return render_template_string(login_template, form=form)
+
+        @app.route("/logout", endpoint="logout")
+        @login_required
+        def logout():
+            """Handle logout request"""
+            logout_user()
+            return redirect(url_for("login"))
+
+        @app.route("/home", endpoint="home")
+        @app.route("/")
+        @login_required
+        def home():
+            """Home page view. Protected view"""
+            return render_template_string(home_template)
+
+        @app.route("/marketing", endpoint="marketing")
+        def marketing():
+            """Unprotected view"""
+            return "<h3> This is marketing page </h3>"
+
+    @app.cli.command("bench-session")
+    @click.option("--requests", "count", default=1000, help="Number of authenticated requests per session type")
+    def bench_session(count):
+        """Compare cookie size and per request session overhead of all session types"""
+        import os
+        import tempfile
+        tmpdir = tempfile.mkdtemp()
+        click.echo("%-8s %14s %14s %14s %12s" % ("type", "cookie bytes", "set-cookie/req", "store writes", "us/req"))
+        for session_type in ("cookie", "memory", "sqlite"):
+            class BenchConfig(Config):
+                SQLALCHEMY_DATABASE_URI = "sqlite:///%s" % os.path.join(tmpdir, "%s.sqlite3" % session_type)
+                SESSION_TYPE = session_type
+                SESSION_SQLITE_PATH = os.path.join(tmpdir, "%s-sessions.sqlite3" % session_type)
+
+            bench_app = create_app(BenchConfig)
+            client = bench_app.test_client()
+            page = client.get("/register").get_data(as_text=True)
+            token = re.search(r'name="csrf_token" type="hidden" value="([^"]+)"', page).group(1)
+            client.post("/register", data={"csrf_token": token, "first_name": "first", "last_name": "last",
+                                           "email": "user@example.com", "password": "password"})
+
+            writes = [0]
+            store = getattr(bench_app.session_interface, "store", None)
+            if store is not None:
+                store_set = store.set
+
+                def counting_set(*args):
+                    writes[0] += 1
+                    return store_set(*args)
+                store.set = counting_set
+
+            set_cookies = 0
+            cookie_size = 0
+            start = time.time()
+            for _ in range(count):
+                response = client.get("/home")
+                assert response.status_code == 200
+                set_cookies += len(response.headers.getlist("Set-Cookie"))
+            elapsed = time.time() - start
+            for cookie in client.cookie_jar:
+                if cookie.name == bench_app.session_cookie_name:
+                    cookie_size = len(cookie.name) + len(cookie.value) + 1
+            click.echo("%-8s %14d %14.2f %14s %12.1f" % (
+                session_type, cookie_size, set_cookies / float(count), writes[0] if store is not None else "-",
+                elapsed / count * 1e6))
+
+    return app
+
+
+if __name__ == "__main__":
+    app = create_app()
+    app.run()
@@ -0,0 +1,813 @@
+"""
+flask-testing-example.py
+
+Requirements:
+ Requirements of examples under test. Examples whose requirements are not installed are skipped.
+
+Usage:
+ - Run smoke tests of all examples using 'python flask-testing-example.py'
+ - Run with 8 worker processes using 'python flask-testing-example.py -j 8'
+ - Clone databases in memory instead of files using 'python flask-testing-example.py --clone memory'
+ - Run only some examples using 'python flask-testing-example.py flask-login-example.py flask-admin-example.py'
+
+Notes:
+    - Importing extensions and running 'create_app()' + 'db.create_all()' is the slow part of every test,
+      and all examples share one 'temp.sqlite3', so tests can not run in parallel.
+    - Here each example is imported and 'create_app()' is called only once, in parent process, against
+      its own template database. Template is seeded once and then never written again.
+    - Tests run in forked worker processes (os.fork, so not available on windows), which inherit already built apps.
+      Before every test, template is copied to worker's own database using sqlite backup api, either in
+      a file per worker ('--clone file') or in memory ('--clone memory'). Tests never share a database file.
+    - Add new tests using '@case("<example-file>.py")'. Test function gets test client and example module.
+      Tests run without app context, like real requests. Wrap direct model access in
+      'with client.application.app_context():'.
+
+References:
+ - http://flask.pocoo.org/docs/1.0/testing/
+ - https://docs.python.org/3/library/sqlite3.html#sqlite3.Connection.backup
+ - https://docs.python.org/3/library/multiprocessing.html#contexts-and-start-methods
+"""
+import argparse
+import atexit
+import contextlib
+import importlib.util
+import multiprocessing
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+import traceback
+
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# config applied to every example under test
+TEST_CONFIG = {
+    "TESTING": True,
+    "WTF_CSRF_ENABLED": False,
+    "MAIL_SUPPRESS_SEND": True,
+    "SQLALCHEMY_TRACK_MODIFICATIONS": False,
+}
+
+
+###################
+# example registry
+###################
+
+EXAMPLES = {}
+
+
+def example(filename, uses_db=True, config=None):
+    """Register example file. Decorated function (if any) seeds template database"""
+    def decorator(seed):
+        EXAMPLES[filename] = {"uses_db": uses_db, "config": config or {}, "seed": seed, "cases": []}
+        return seed
+    return decorator
+
+
+def case(filename):
+    """Register test case for example"""
+    def decorator(func):
+        EXAMPLES[filename]["cases"].append(func)
+        return func
+    return decorator
+
+
+def _seed_user(module, **fields):
+    from werkzeug.security import generate_password_hash
+    user = module.User(password=generate_password_hash("password"), **fields)
+    module.db.session.add(user)
+    module.db.session.commit()
+    return user
+
+
+##########################
+# examples and test cases
+##########################
+
+@example("flask-login-example.py")
+def seed_login(module):
+    _seed_user(module, email="seed@example.com", first_name="seed", last_name="user")
+
+
+@case("flask-login-example.py")
+def test_login_marketing(client, module):
+    assert client.get("/marketing").status_code == 200
+
+
+@case("flask-login-example.py")
+def test_login_home_requires_login(client, module):
+    response = client.get("/home")
+    assert response.status_code == 302 and "/login" in response.headers["Location"]
+
+
+@case("flask-login-example.py")
+def test_login_register(client, module):
+    response = client.post("/register", data={"first_name": "first", "last_name": "last", "password": "password",
+                                              "email": "new@example.com"})
+    assert response.status_code == 302
+    assert client.get("/home").status_code == 200
+    with client.application.app_context():
+        assert module.User.query.count() == 2
+
+
+@case("flask-login-example.py")
+def test_login_register_duplicate_email(client, module):
+    response = client.post("/register", data={"first_name": "first", "last_name": "last", "password": "password",
+                                              "email": "seed@example.com"})
+    assert response.status_code == 200
+    with client.application.app_context():
+        assert module.User.query.count() == 1
+
+
+@example("flask-admin-example.py")
+def seed_admin(module):
+    user = module.User(username="seed")
+    module.db.session.add(user)
+    module.db.session.add(module.Post(title="hello", text="world", user=user))
+    module.db.session.commit()
+
+
+@case("flask-admin-example.py")
+def test_admin_index(client, module):
+    assert client.get("/admin/").status_code == 200
+
+
+@case("flask-admin-example.py")
+def test_admin_user_list(client, module):
+    response = client.get("/admin/user/")
+    assert response.status_code == 200 and b"seed" in response.data
+
+
+@case("flask-admin-example.py")
+def test_admin_create_user(client, module):
+    response = client.post("/admin/user/new/", data={"username": "second"})
+    assert response.status_code == 302
+    with client.application.app_context():
+        assert module.User.query.filter_by(username="second").count() == 1
+
+
+@example("flask-security-example.py")
+def seed_security(module):
+    pass
+
+
+@case("flask-security-example.py")
+def test_security_marketing(client, module):
+    assert client.get("/marketing").status_code == 200
+
+
+@case("flask-security-example.py")
+def test_security_home_requires_login(client, module):
+    assert client.get("/home").status_code == 302
+
+
+@example("flask-security-with-flask-jwt-extended-example.py")
+def seed_security_jwt(module):
+    pass
+
+
+@case("flask-security-with-flask-jwt-extended-example.py")
+def test_security_jwt_marketing(client, module):
+    assert client.get("/marketing").status_code == 200
+
+
+@case("flask-security-with-flask-jwt-extended-example.py")
+def test_security_jwt_requires_token(client, module):
+    assert client.get("/api/jwttest").status_code == 401
+
+
+@example("flask-jwt-extended-example.py", uses_db=False)
+def seed_jwt_extended(module):
+    pass
+
+
+@case("flask-jwt-extended-example.py")
+def test_jwt_extended_list_users(client, module):
+    response = client.post("/api/auth/create_token", json={"username": "user1", "password": "pass1"})
+    token = response.get_json()["access_token"]
+    response = client.get("/api/users", headers={"Authorization": "Bearer %s" % token})
+    assert response.get_json()["users"] == ["user1", "user2"]
+
+
+@case("flask-jwt-extended-example.py")
+def test_jwt_extended_requires_token(client, module):
+    assert client.get("/api/users").status_code == 401
+
+
+@example("flask-fast-json-example.py", uses_db=False, config={"USER_COUNT": 2500})
+def seed_fast_json(module):
+    pass
+
+
+@case("flask-fast-json-example.py")
+def test_fast_json_page(client, module):
+    data = client.get("/api/users?page=2&per_page=5").get_json()
+    assert [user["id"] for user in data["users"]] == [5, 6, 7, 8, 9]
+
+
+@case("flask-fast-json-example.py")
+def test_fast_json_stream(client, module):
+    data = client.get("/api/users/stream").get_json()
+    assert len(data["users"]) == data["total"] == 2500
+
+
+@case("flask-fast-json-example.py")
+def test_fast_json_non_string_keys(client, module):
+    import json
+    for name, dumps in module.available_backends():
+        if name == "ujson":
+            # ujson 1.x writes None key as "None" (see Notes), only int keys match flask
+            assert json.loads(dumps({1: "a"}).decode("utf-8")) == {"1": "a"}
+            continue
+        assert json.loads(dumps({2: "a", None: "b", False: "c"}).decode("utf-8")) == \
+            {"2": "a", "null": "b", "false": "c"}, name
+
+
+@example("flask-server-side-session-example.py", config={"SESSION_TYPE": "memory"})
+def seed_server_side_session(module):
+    _seed_user(module, email="seed@example.com", first_name="seed", last_name="user")
+
+
+@case("flask-server-side-session-example.py")
+def test_server_side_session_login(client, module):
+    response = client.post("/login", data={"email": "seed@example.com", "password": "password"})
+    assert response.status_code == 302
+    assert client.get("/home").status_code == 200
+
+
+def _session_id(client, app):
+    for cookie in client.cookie_jar:
+        if cookie.name == app.session_cookie_name:
+            return app.session_interface.get_signer(app).unsign(cookie.value).decode("utf-8")
+    return None
+
+
+@case("flask-server-side-session-example.py")
+def test_server_side_session_regenerates_sid(client, module):
+    app = client.application
+    store = app.session_interface.store
+    # login_required flashes "Please log in" message, which stores anonymous session
+    client.get("/home")
+    anonymous_sid = _session_id(client, app)
+    assert anonymous_sid is not None
+    client.post("/login", data={"email": "seed@example.com", "password": "password"})
+    login_sid = _session_id(client, app)
+    assert login_sid != anonymous_sid and store.get(anonymous_sid) is None
+    client.get("/logout")
+    assert _session_id(client, app) != login_sid and store.get(login_sid) is None
+
+
+@case("flask-server-side-session-example.py")
+def test_server_side_session_refreshes_non_permanent(client, module):
+    app = client.application
+    store = app.session_interface.store
+    client.post("/login", data={"email": "seed@example.com", "password": "password"})
+    sid = _session_id(client, app)
+    data, _ = store.get(sid)
+    store.set(sid, data, time.time() + 10)
+    assert client.get("/home").status_code == 200
+    assert store.get(sid)[1] > time.time() + 10
+
+
+# flush interval is long, so only tests flush the queue
+@example("flask-write-behind-example.py", config={"WRITE_BEHIND_FLUSH_INTERVAL": 3600})
+def seed_write_behind(module):
+    _seed_user(module, email="seed@example.com", first_name="seed", last_name="user")
+
+
+def _count_statements(engine, counter, prefix=""):
+    """Append every executed statement starting with prefix to counter. Returns listener to remove"""
+    from sqlalchemy import event
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if statement.startswith(prefix):
+            counter.append(statement)
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    return before_cursor_execute
+
+
+@case("flask-write-behind-example.py")
+def test_write_behind_login_count_sync(client, module):
+    module.write_behind.enabled = False
+    try:
+        client.post("/login", data={"email": "seed@example.com", "password": "password"})
+        assert client.get("/home").status_code == 200
+    finally:
+        module.write_behind.enabled = True
+    with client.application.app_context():
+        assert module.User.query.first().login_count == 1
+
+
+@case("flask-write-behind-example.py")
+def test_write_behind_coalesces_updates(client, module):
+    from sqlalchemy import event
+    client.post("/login", data={"email": "seed@example.com", "password": "password"})
+    client.get("/home")
+    client.get("/home")
+    module.write_behind.increment(module.User, 1, "login_count", 2)
+    with client.application.app_context():
+        assert module.User.query.first().login_count == 0
+        engine = module.db.get_engine(client.application)
+        updates = []
+        listener = _count_statements(engine, updates, "UPDATE")
+        try:
+            assert module.write_behind.flush() == 1
+        finally:
+            event.remove(engine, "before_cursor_execute", listener)
+        user = module.User.query.first()
+        assert len(updates) == 1
+        assert user.login_count == 3 and user.last_login_at is not None and user.last_seen_at is not None
+
+
+@case("flask-write-behind-example.py")
+def test_write_behind_request_runs_one_query(client, module):
+    from sqlalchemy import event
+    client.post("/login", data={"email": "seed@example.com", "password": "password"})
+    with client.application.app_context():
+        engine = module.db.get_engine(client.application)
+    statements = []
+    listener = _count_statements(engine, statements)
+    try:
+        assert client.get("/home").status_code == 200
+    finally:
+        event.remove(engine, "before_cursor_execute", listener)
+    # only user loader query. last_seen_at update is queued
+    assert len(statements) == 1 and statements[0].startswith("SELECT")
+    module.write_behind.flush()
+
+
+@case("flask-write-behind-example.py")
+def test_write_behind_requeue_and_stop(client, module):
+    from sqlalchemy import event
+    write_behind = module.write_behind
+    write_behind.increment(module.User, 1, "login_count")
+    with client.application.app_context():
+        engine = module.db.get_engine(client.application)
+
+        def fail(*args):
+            raise RuntimeError("database is down")
+        event.listen(engine, "before_cursor_execute", fail)
+        try:
+            write_behind.flush()
+            assert False, "flush should fail"
+        except RuntimeError:
+            pass
+        finally:
+            event.remove(engine, "before_cursor_execute", fail)
+        # failed batch is requeued and merged with updates queued after it
+        write_behind.increment(module.User, 1, "login_count", 2)
+        assert [entry["inc"] for entry in write_behind._pending.values()] == [{"login_count": 3}]
+        write_behind.stop()
+        assert write_behind._thread is None and not write_behind._pending
+        assert module.User.query.first().login_count == 3
+
+
+@example("flask-memory-profiling-example.py", config={"SECURITY_PASSWORD_HASH": "plaintext"})
+def seed_memory_profiling(module):
+    from datetime import datetime
+    from flask import current_app
+    datastore = current_app.extensions["security"].datastore
+    user = datastore.create_user(email="admin@example.com", password="password", confirmed_at=datetime.utcnow())
+    datastore.add_role_to_user(user, datastore.find_or_create_role("admin"))
+    module.db.session.commit()
+
+
+@case("flask-memory-profiling-example.py")
+def test_memory_profiling_report_requires_admin(client, module):
+    assert client.get("/admin/memory").status_code in (302, 403)
+
+
+@case("flask-memory-profiling-example.py")
+def test_memory_profiling_report(client, module):
+    client.post("/login", data={"email": "admin@example.com", "password": "password"})
+    assert client.post("/admin/memory", data={"action": "start"}).get_json()["active"] is True
+    for _ in range(3):
+        client.get("/marketing")
+    data = client.post("/admin/memory", data={"action": "stop"}).get_json()
+    assert data["active"] is False
+    assert [stats["requests"] for stats in data["endpoints"] if stats["endpoint"] == "test"] == [3]
+
+
+@case("flask-memory-profiling-example.py")
+def test_memory_profiling_charges_only_sampled_request(client, module):
+    profiler = module.memory_profiler
+    every, profiler.every = profiler.every, 1
+    profiler.reset()
+    profiler.start()
+    try:
+        # /register renders templates and allocates caches between /marketing samples
+        for _ in range(3):
+            client.get("/marketing")
+            client.get("/register")
+        report = dict((stats["endpoint"], stats) for stats in profiler.report())
+    finally:
+        profiler.stop()
+        profiler.reset()
+        profiler.every = every
+    assert report["test"]["requests"] == 3 and report["test"]["samples"] == 2
+    assert report["test"]["retained_last_sample"] < 4096, report["test"]
+    assert not [site for site in report["test"]["top"] if "jinja2" in site["site"]]
+
+
+@example("flask-bloom-filter-example.py", config={"EMAIL_FILTER_SNAPSHOT": None, "EMAIL_FILTER_CAPACITY": 1000})
+def seed_bloom_filter(module):
+    _seed_user(module, email="seed@example.com", first_name="seed", last_name="user")
+    module.email_filter.rebuild()
+
+
+@case("flask-bloom-filter-example.py")
+def test_bloom_filter_register_duplicate_email(client, module):
+    response = client.post("/register", data={"first_name": "first", "last_name": "last", "password": "password",
+                                              "email": " Seed@Example.com"})
+    assert response.status_code == 200
+    with client.application.app_context():
+        assert module.User.query.count() == 1
+
+
+@case("flask-bloom-filter-example.py")
+def test_bloom_filter_register(client, module):
+    response = client.post("/register", data={"first_name": "first", "last_name": "last", "password": "password",
+                                              "email": "New@example.com"})
+    assert response.status_code == 302
+    with client.application.app_context():
+        assert module.User.query.filter_by(email="new@example.com").count() == 1
+    assert "new@example.com" in module.email_filter.bloom
+
+
+@case("flask-bloom-filter-example.py")
+def test_bloom_filter_snapshot_covers_other_workers(client, module):
+    app = client.application
+    fd, path = tempfile.mkstemp(suffix="-email-filter.bin")
+    os.close(fd)
+    app.config["EMAIL_FILTER_SNAPSHOT"] = path
+    try:
+        with app.app_context():
+            # id 2 is inserted by "other worker", so this worker's filter does not see it
+            module.db.session.execute(module.User.__table__.insert().values(id=2, email="other@example.com"))
+            module.db.session.commit()
+        client.post("/register", data={"first_name": "first", "last_name": "last", "password": "password",
+                                       "email": "new@example.com"})
+        module.email_filter.save()
+        bloom, max_id = module.BloomFilter.load(path)
+        assert max_id == 3 and "other@example.com" in bloom and "new@example.com" in bloom
+        # sizing comes from snapshot, not from current config
+        app.config["EMAIL_FILTER_CAPACITY"] = 10
+        with app.app_context():
+            bloom = module.email_filter.load()
+        assert (bloom.capacity, bloom.error_rate) == (1000, 0.01)
+    finally:
+        app.config["EMAIL_FILTER_CAPACITY"] = 1000
+        app.config["EMAIL_FILTER_SNAPSHOT"] = None
+        os.remove(path)
+
+
+@example("flask-admin-aggregates-example.py")
+def seed_admin_aggregates(module):
+    user = module.User(username="seed")
+    module.db.session.add(user)
+    module.db.session.add_all([module.Post(title="post %d" % i, text="text", user=user) for i in range(3)])
+    module.db.session.commit()
+
+
+@case("flask-admin-aggregates-example.py")
+def test_admin_aggregates_dashboard(client, module):
+    response = client.get("/admin/")
+    assert response.status_code == 200 and b"1 authors, 3 posts" in response.data
+
+
+@case("flask-admin-aggregates-example.py")
+def test_admin_aggregates_follow_posts(client, module):
+    db, Post, UserStats = module.db, module.Post, module.UserStats
+    with client.application.app_context():
+        second = module.User(username="second")
+        db.session.add(second)
+        db.session.commit()
+        post = Post.query.first()
+        post.user = second
+        db.session.delete(Post.query.filter(Post.id != post.id).first())
+        db.session.add(Post(title="new", text="text", user=second))
+        db.session.commit()
+        counts = {stats.user.username: stats.post_count for stats in UserStats.query}
+        assert counts == {"seed": 1, "second": 2}
+        assert UserStats.query.get(second.id).last_post_at is not None
+
+
+@case("flask-admin-aggregates-example.py")
+def test_admin_aggregates_delete_user_with_foreign_keys(client, module):
+    db, Post, UserStats = module.db, module.Post, module.UserStats
+    with client.application.app_context():
+        user = module.User(username="leaving")
+        post = Post(title="post", text="text", user=user)
+        db.session.add_all([user, post])
+        db.session.commit()
+        db.session.delete(post)
+        db.session.commit()
+        user_id = user.id
+        # pysqlite starts transaction lazily, so pragma runs outside of it and takes effect
+        db.session.execute("PRAGMA foreign_keys=ON")
+        try:
+            db.session.delete(user)
+            db.session.commit()
+        finally:
+            db.session.execute("PRAGMA foreign_keys=OFF")
+            db.session.commit()
+        assert UserStats.query.get(user_id) is None
+
+
+# replicas are empty in memory databases without heartbeat, so they are never healthy unless test
+# points them to files using '_file_replicas'
+@example("flask-read-replica-example.py", config={
+    "SQLALCHEMY_BINDS": {"replica1": "sqlite://", "replica2": "sqlite://"},
+    "REPLICA_BINDS": ["replica1", "replica2"],
+    "REPLICA_REFRESH_INTERVAL": 0,
+})
+def seed_read_replica(module):
+    module.db.session.add(module.User(username="seed"))
+    module.db.session.commit()
+
+
+@case("flask-read-replica-example.py")
+def test_read_replica_fallback_to_primary(client, module):
+    # replica1 is empty in memory database without heartbeat, so it is never healthy
+    assert client.get("/api/users").get_json()["users"] == ["seed"]
+    assert client.get("/api/db-routing").get_json()["replicas"]["replica1"]["healthy"] is False
+
+
+@case("flask-read-replica-example.py")
+def test_read_replica_admin_list(client, module):
+    assert client.post("/api/users", json={"username": "second"}).status_code == 201
+    response = client.get("/admin/user/")
+    assert response.status_code == 200 and b"second" in response.data
+
+
+@example("flask-jwt-key-rotation-example.py", uses_db=False, config={"JWT_KEYRING_RELOAD_INTERVAL": 0})
+def seed_jwt_key_rotation(module):
+    fd, path = tempfile.mkstemp(suffix="-keyring.json")
+    os.close(fd)
+    atexit.register(os.remove, path)
+    module.app.config["JWT_KEYRING_PATH"] = path
+    now = time.time()
+    module.KeyRing.write_file(path, [
+        dict(module.KEY_GENERATORS["RS256"](), kid="current", alg="RS256", activate_at=now - 60, retire_at=None),
+        dict(module.KEY_GENERATORS["RS256"](), kid="next", alg="RS256", activate_at=now + 3600, retire_at=None),
+        dict(module.KEY_GENERATORS["HS256"](), kid="retired", alg="HS256", activate_at=now - 120, retire_at=now),
+    ])
+
+
+@case("flask-jwt-key-rotation-example.py")
+def test_jwt_key_rotation_signs_with_active_key(client, module):
+    import jwt
+    response = client.post("/api/auth/create_token", json={"username": "user1", "password": "pass1"})
+    token = response.get_json()["access_token"]
+    assert jwt.get_unverified_header(token)["kid"] == "current"
+    response = client.get("/api/users", headers={"Authorization": "Bearer %s" % token})
+    assert response.get_json()["users"] == ["user1", "user2"]
+
+
+@case("flask-jwt-key-rotation-example.py")
+def test_jwt_key_rotation_rejects_retired_key(client, module):
+    import jwt
+    keys = {data["kid"]: data for data in module.KeyRing.read_file(module.app.config["JWT_KEYRING_PATH"])}
+    payload = {"identity": "user1", "type": "access", "fresh": False, "jti": "x", "iat": int(time.time())}
+    token = jwt.encode(payload, keys["retired"]["secret"], algorithm="HS256", headers={"kid": "retired"})
+    if isinstance(token, bytes):
+        # PyJWT<2 returns bytes
+        token = token.decode("ascii")
+    response = client.get("/api/users", headers={"Authorization": "Bearer %s" % token})
+    assert response.status_code == 422
+
+
+@example("flask-admission-control-example.py", config={"SECURITY_PASSWORD_HASH": "plaintext"})
+def seed_admission_control(module):
+    from datetime import datetime
+    from flask import current_app
+    datastore = current_app.extensions["security"].datastore
+    datastore.create_user(email="seed@example.com", password="password", confirmed_at=datetime.utcnow())
+    module.db.session.commit()
+
+
+@case("flask-admission-control-example.py")
+def test_admission_control_cheap_route(client, module):
+    assert client.get("/marketing").status_code == 200
+    stats = client.get("/admission").get_json()
+    assert stats["classes"]["cheap"]["admitted"] >= 1 and stats["in_flight"] == 1
+
+
+@case("flask-admission-control-example.py")
+def test_admission_control_sheds_hashing(client, module):
+    hashing = module.admission.classes["hashing"]
+    hashing.in_flight = int(hashing.limit)
+    try:
+        response = client.post("/login", data={"email": "seed@example.com", "password": "password"})
+        assert response.status_code == 503 and response.headers["Retry-After"] == "1"
+        assert client.get("/marketing").status_code == 200
+    finally:
+        hashing.reset()
+
+
+@case("flask-admission-control-example.py")
+def test_admission_control_sheds_before_loading_user(client, module):
+    assert client.post("/login", data={"email": "seed@example.com", "password": "password"}).status_code == 302
+    assert client.get("/admin/user/").status_code == 200
+    statements = []
+    db_class = module.admission.classes["db"]
+    db_class.in_flight = int(db_class.limit)
+    with client.application.app_context():
+        engine = module.db.get_engine(client.application)
+    listener = _count_statements(engine, statements)
+    try:
+        assert client.get("/admin/user/").status_code == 503
+        assert statements == []
+    finally:
+        from sqlalchemy import event
+        event.remove(engine, "before_cursor_execute", listener)
+        db_class.reset()
+
+
+@contextlib.contextmanager
+def _file_replicas(client, module):
+    """Point replica binds to per worker files refreshed from primary"""
+    app = client.application
+    binds = app.config["SQLALCHEMY_BINDS"]
+    tmpdir = tempfile.mkdtemp(prefix="flask-examples-replica-")
+    app.config["SQLALCHEMY_BINDS"] = {name: "sqlite:///%s" % os.path.join(tmpdir, "%s.sqlite3" % name)
+                                      for name in binds}
+    try:
+        with app.app_context():
+            module.refresh_replicas(app)
+        module.router.check(force=True)
+        yield module.router
+    finally:
+        app.config["SQLALCHEMY_BINDS"] = binds
+        module.router.check(force=True)
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+@case("flask-read-replica-example.py")
+def test_read_replica_one_replica_per_request(client, module):
+    with _file_replicas(client, module) as router:
+        assert all(health["healthy"] for health in router.health.values())
+        before = dict(router.reads)
+        response = client.get("/admin/user/")
+        assert response.status_code == 200 and b"seed" in response.data
+        used = [name for name in router.reads if router.reads[name] != before[name]]
+        # count and rows queries of list page go to same replica
+        assert len(used) == 1 and used[0] != "primary" and router.reads[used[0]] - before[used[0]] >= 2
+
+
+@case("flask-read-replica-example.py")
+def test_read_replica_read_your_writes(client, module):
+    with _file_replicas(client, module):
+        assert client.post("/api/users", json={"username": "second"}).status_code == 201
+        # replicas are not refreshed yet. Writer reads from primary, others read stale replica
+        assert client.get("/api/users").get_json()["users"] == ["seed", "second"]
+        other = client.application.test_client()
+        assert other.get("/api/users").get_json()["users"] == ["seed"]
+
+
+@case("flask-read-replica-example.py")
+def test_read_replica_stale_replica_failover(client, module):
+    with _file_replicas(client, module) as router:
+        app = client.application
+        with app.app_context():
+            module.db.session.add(module.User(username="second"))
+            module.db.session.commit()
+            # replica1 is refreshed but its heartbeat is old, replica2 is never refreshed again
+            module.refresh_replicas(app)
+            module.db.get_engine(app, bind="replica1").execute(
+                "UPDATE replica_heartbeat SET beat_at = beat_at - 3600")
+            module.db.get_engine(app, bind="replica2").execute(
+                "UPDATE replica_heartbeat SET beat_at = beat_at - 3600")
+        router.check(force=True)
+        assert not any(health["healthy"] for health in router.health.values())
+        before = router.reads["primary"]
+        assert client.get("/api/users").get_json()["users"] == ["seed", "second"]
+        assert router.reads["primary"] > before
+
+
+#########
+# runner
+#########
+
+# examples built in parent process, inherited by forked workers
+BUILT = {}
+
+
+def load_module(filename):
+    name = os.path.splitext(filename)[0].replace("-", "_")
+    spec = importlib.util.spec_from_file_location(name, os.path.join(BASE_DIR, filename))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def build_example(filename, workdir):
+    """Import example, build app once and seed its template database"""
+    spec = EXAMPLES[filename]
+    module = load_module(filename)
+    config = dict(TEST_CONFIG, **spec["config"])
+    template = None
+    if spec["uses_db"]:
+        template = os.path.join(workdir, filename.replace(".py", "-template.sqlite3"))
+        config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///%s" % template
+
+    if hasattr(module, "create_app"):
+        for key, value in config.items():
+            setattr(module.Config, key, value)
+        app = module.create_app()
+    else:
+        app = module.app
+    app.config.update(config)
+
+    if spec["uses_db"]:
+        with app.app_context():
+            spec["seed"](module)
+            module.db.session.remove()
+            # do not leak parent connections into forked workers
+            module.db.get_engine(app).dispose()
+    else:
+        spec["seed"](module)
+    return {"module": module, "app": app, "template": template}
+
+
+def clone_database(built, workdir, mode):
+    """Copy template database to this worker's own database"""
+    app, db = built["app"], built["module"].db
+    if mode == "memory":
+        uri = "sqlite://"
+    else:
+        name = os.path.basename(built["template"]).replace("-template", "-%d" % os.getpid())
+        uri = "sqlite:///%s" % os.path.join(workdir, name)
+    app.config["SQLALCHEMY_DATABASE_URI"] = uri
+    with app.app_context():
+        db.session.remove()
+        source = sqlite3.connect(built["template"])
+        target = db.get_engine(app).raw_connection()
+        try:
+            source.backup(target.connection)
+        finally:
+            target.close()
+            source.close()
+
+
+def run_case(task):
+    filename, index, workdir, clone = task
+    built = BUILT[filename]
+    func = EXAMPLES[filename]["cases"][index]
+    start = time.time()
+    try:
+        if built["template"] is not None:
+            clone_database(built, workdir, clone)
+        # no app context around test. Flask test client would reuse it for every request, so 'g' and
+        # 'db.session' would leak between requests of one test
+        func(built["app"].test_client(), built["module"])
+        error = None
+    except Exception:
+        error = traceback.format_exc()
+    return filename, func.__name__, time.time() - start, error
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run smoke tests of flask examples")
+    parser.add_argument("examples", nargs="*", help="Example files to test. Default is all")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(), help="Number of worker processes")
+    parser.add_argument("--clone", choices=("file", "memory"), default="file", help="Where to clone template db")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="flask-examples-")
+    start = time.time()
+    skipped = []
+    for filename in args.examples or sorted(EXAMPLES):
+        try:
+            BUILT[filename] = build_example(filename, workdir)
+        except ImportError as e:
+            skipped.append((filename, str(e)))
+    built_at = time.time()
+
+    tasks = [(filename, index, workdir, args.clone)
+             for filename in BUILT for index in range(len(EXAMPLES[filename]["cases"]))]
+    if args.jobs > 1:
+        with multiprocessing.get_context("fork").Pool(args.jobs) as pool:
+            results = list(pool.imap_unordered(run_case, tasks))
+    else:
+        results = [run_case(task) for task in tasks]
+    finished_at = time.time()
+    shutil.rmtree(workdir, ignore_errors=True)
+
+    failed = 0
+    for filename, name, elapsed, error in sorted(results):
+        print("%-4s %-52s %-40s %6.3fs" % ("FAIL" if error else "ok", filename, name, elapsed))
+        if error:
+            failed += 1
+            print(error)
+    for filename, reason in skipped:
+        print("skip %-52s %s" % (filename, reason))
+    print("\n%d passed, %d failed, %d examples skipped | build %.2fs, run %.2fs with %d jobs" % (
+        len(results) - failed, failed, len(skipped), built_at - start, finished_at - built_at, args.jobs))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
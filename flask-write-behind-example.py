@@ -0,0 +1,499 @@
+"""
+flask-write-behind-example.py
+
+Requirements:
+ Click==7.0
+ Flask==1.0.2
+ Flask-Login==0.4.1
+ Flask-SQLAlchemy==2.3.2
+ Flask-WTF==0.14.2
+ itsdangerous==1.1.0
+ Jinja2==2.10
+ MarkupSafe==1.1.0
+ SQLAlchemy==1.2.17
+ Werkzeug==0.14.1
+ WTForms==2.2.1
+
+Usage:
+ - Run script using 'python flask-write-behind-example.py'
+ - Visit below urls
+    - url without login protection 'http://127.0.0.1:5000/marketing'
+    - url with login protection 'http://127.0.0.1:5000/home'
+ - Compare authenticated request throughput with and without write-behind using
+   'FLASK_APP=flask-write-behind-example.py flask bench-write-behind --requests 2000 --threads 8'
+
+Notes:
+    - Models here track 'date_modified', 'last_seen_at', 'last_login_at' and 'login_count' (same idea as
+      flask-security 'SECURITY_TRACKABLE'). Updating them synchronously means every authenticated request
+      takes sqlite write lock and commits.
+    - These updates are not critical, so they are queued instead. Updates for same row are coalesced, i.e.
+      later values overwrite earlier ones and counters are summed, so 100 requests of one user become one UPDATE.
+    - Background thread flushes queue in one transaction every 'WRITE_BEHIND_FLUSH_INTERVAL' seconds
+      (upper bound of lag), or earlier when 'WRITE_BEHIND_MAX_PENDING' rows are pending. Pending updates are
+      flushed on shutdown too.
+    - Never use this for data which must be durable or read back in same request (passwords, registrations).
+    - Set 'WRITE_BEHIND_ENABLED = False' to apply updates synchronously in request transaction.
+
+References:
+ - https://flask-login.readthedocs.io/en/latest/
+ - https://docs.sqlalchemy.org/en/latest/core/tutorial.html#executing-multiple-statements
+ - https://pythonhosted.org/Flask-Security/configuration.html
+"""
+import atexit
+import threading
+import time
+from datetime import datetime
+
+import click
+from flask import Flask, flash, redirect, render_template_string, url_for, request
+from sqlalchemy import bindparam
+from werkzeug.security import generate_password_hash, check_password_hash
+
+# flask-sqlalchemy setup
+from flask_sqlalchemy import SQLAlchemy
+db = SQLAlchemy()
+
+# flask-login setup
+from flask_login import LoginManager, current_user, login_required, login_user, logout_user
+login_manager = LoginManager()
+
+# csrf setup
+from flask_wtf.csrf import CSRFProtect
+csrf = CSRFProtect()
+
+
+######################
+# write-behind queue
+######################
+
+class WriteBehind(object):
+    """
+    Queue of non critical row updates.
+    Use 'update(Model, pk, column=value)' to set columns and 'increment(Model, pk, column, n)' for counters.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.enabled = False
+        self.flush_interval = 1.0
+        self.max_pending = 1000
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+        self.stats = {"queued": 0, "flushed_rows": 0, "flushes": 0, "max_lag": 0.0}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("WRITE_BEHIND_ENABLED", True)
+        app.config.setdefault("WRITE_BEHIND_FLUSH_INTERVAL", 1.0)
+        app.config.setdefault("WRITE_BEHIND_MAX_PENDING", 1000)
+        self.app = app
+        self.enabled = app.config["WRITE_BEHIND_ENABLED"]
+        self.flush_interval = app.config["WRITE_BEHIND_FLUSH_INTERVAL"]
+        self.max_pending = app.config["WRITE_BEHIND_MAX_PENDING"]
+        self.stats = {"queued": 0, "flushed_rows": 0, "flushes": 0, "max_lag": 0.0}
+        app.extensions["write_behind"] = self
+        atexit.register(self.stop)
+
+    def update(self, model, pk, **values):
+        self._enqueue(model, pk, values, {})
+
+    def increment(self, model, pk, column, n=1):
+        self._enqueue(model, pk, {}, {column: n})
+
+    def _enqueue(self, model, pk, values, increments):
+        if not self.enabled:
+            self._apply_now(model, pk, values, increments)
+            return
+        key = (model.__table__, pk)
+        with self._lock:
+            entry = self._pending.get(key)
+            if entry is None:
+                entry = self._pending[key] = {"set": {}, "inc": {}, "since": time.time()}
+            entry["set"].update(values)
+            for column, n in increments.items():
+                entry["inc"][column] = entry["inc"].get(column, 0) + n
+            self.stats["queued"] += 1
+            pending = len(self._pending)
+        self._ensure_thread()
+        if pending >= self.max_pending:
+            self._wakeup.set()
+
+    @staticmethod
+    def _apply_now(model, pk, values, increments):
+        """Synchronous path used when write-behind is disabled. Runs in request transaction, caller commits"""
+        table = model.__table__
+        values = dict(values)
+        for column, n in increments.items():
+            values[column] = table.c[column] + n
+        db.session.query(model).filter(list(table.primary_key.columns)[0] == pk).update(
+            values, synchronize_session=False)
+
+    def _ensure_thread(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stopped.clear()
+                self._thread = threading.Thread(target=self._run, name="write-behind")
+                self._thread.daemon = True
+                self._thread.start()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                self.app.logger.exception("Write-behind flush failed")
+
+    def _requeue(self, batch):
+        """Put back failed batch. Values queued meanwhile are newer, so they win"""
+        with self._lock:
+            for key, entry in batch.items():
+                current = self._pending.get(key)
+                if current is None:
+                    self._pending[key] = entry
+                    continue
+                entry["set"].update(current["set"])
+                current["set"] = entry["set"]
+                for column, n in entry["inc"].items():
+                    current["inc"][column] = current["inc"].get(column, 0) + n
+                current["since"] = min(current["since"], entry["since"])
+
+    def flush(self):
+        """Write all pending updates in one transaction. Return number of updated rows"""
+        with self._lock:
+            batch, self._pending = self._pending, {}
+        if not batch:
+            return 0
+
+        # group rows having same columns, so each group is one executemany
+        groups = {}
+        oldest = time.time()
+        for (table, pk), entry in batch.items():
+            signature = (table, tuple(sorted(entry["set"])), tuple(sorted(entry["inc"])))
+            params = {"_pk": pk}
+            for column, value in entry["set"].items():
+                params["_set_" + column] = value
+            for column, n in entry["inc"].items():
+                params["_inc_" + column] = n
+            groups.setdefault(signature, []).append(params)
+            oldest = min(oldest, entry["since"])
+
+        try:
+            with self.app.app_context():
+                with db.get_engine(self.app).begin() as conn:
+                    for (table, set_columns, inc_columns), params in groups.items():
+                        values = {column: bindparam("_set_" + column) for column in set_columns}
+                        for column in inc_columns:
+                            values[column] = table.c[column] + bindparam("_inc_" + column)
+                        pk_column = list(table.primary_key.columns)[0]
+                        conn.execute(table.update().where(pk_column == bindparam("_pk")).values(values), params)
+        except Exception:
+            self._requeue(batch)
+            raise
+
+        self.stats["flushes"] += 1
+        self.stats["flushed_rows"] += len(batch)
+        self.stats["max_lag"] = max(self.stats["max_lag"], time.time() - oldest)
+        return len(batch)
+
+    def stop(self):
+        """Stop background thread and flush whatever is pending"""
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self.app is not None and self._pending:
+            self.flush()
+
+
+write_behind = WriteBehind()
+
+
+##################
+# database models
+##################
+
+from flask_login import UserMixin
+from sqlalchemy.sql import func
+
+
+class User(db.Model, UserMixin):
+    id = db.Column(db.Integer, primary_key=True)
+    date_created = db.Column(db.DateTime, server_default=func.now())
+    date_modified = db.Column(db.DateTime, onupdate=func.now())
+    email = db.Column(db.String(255), unique=True)
+    password = db.Column(db.String(255))
+    first_name = db.Column(db.String(255))
+    last_name = db.Column(db.String(255))
+    # tracking fields, updated using write-behind queue
+    last_seen_at = db.Column(db.DateTime())
+    last_login_at = db.Column(db.DateTime())
+    login_count = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+
+
+####################
+# login forms
+####################
+
+from flask_wtf.form import FlaskForm
+from wtforms import StringField, PasswordField
+from wtforms.fields.html5 import EmailField
+from wtforms.validators import Email, Length, InputRequired, ValidationError
+
+
+class RegisterForm(FlaskForm):
+    first_name = StringField("First Name", validators=[InputRequired(), Length(max=32)])
+    last_name = StringField("Last Name", validators=[InputRequired(), Length(max=32)])
+    email = EmailField("Email", validators=[InputRequired(), Email()])
+    password = PasswordField("Password", validators=[InputRequired(), Length(min=5, max=32)])
+
+    def validate_email(self, email):
+        user = User.query.filter_by(email=email.data).first()
+        if user is not None:
+            raise ValidationError("Please use a different email")
+
+
+class LoginForm(FlaskForm):
+    email = EmailField("Email", validators=[InputRequired(), Email()])
+    password = PasswordField("Password", validators=[InputRequired(), Length(min=5, max=32)])
+
+
+####################
+# Sample templates
+###################
+
+register_template = """
+<form method="post" action="{{ url_for('register') }}">
+    {{ form.csrf_token }}
+  <h1>Sign up</h1>
+        {% with messages = get_flashed_messages() %}
+        {% if messages %}
+        {% for message in messages %}
+                {{ message }}
+        {% endfor %}
+        {% endif %}
+        {% endwith %}
+
+    <p><input type="text"  name="first_name" placeholder="First Name" required autofocus></p>
+    <p><input type="text" name="last_name" placeholder="Last Name" required autofocus></p>
+    <p><input type="text" name="email" placeholder="email" required autofocus></p>
+    <p><input type="password" name="password" placeholder="password" required></p>
+    <p><button type="submit">Register</button></p>
+    <p><a href="{{ url_for('login') }}">Already have account ?</a></p>
+</form>
+"""
+
+login_template = """
+<form method="post" action="{{ url_for('login') }}">
+    {{ form.csrf_token }}
+        <h1> Login </h1>
+        {% with messages = get_flashed_messages() %}
+        {% if messages %}
+        {% for message in messages %}
+           {{ message }}
+        {% endfor %}
+        {% endif %}
+        {% endwith %}
+
+    <p><input type="text" name="email" placeholder="email" required autofocus></p>
+    <p><input type="password" name="password" placeholder="password" required></p>
+    <p><button class="btn btn-lg btn-primary btn-block" type="submit">Sign in</button></p>
+    <p><a href="{{ url_for('register') }}">Not registered ?</a></p>
+</form>
+"""
+
+home_template = """
+<h3> Secured Sweet Home where no worries !!!! <h3>
+<p> Logins: {{ current_user.login_count }}, last seen: {{ current_user.last_seen_at }} </p>
+<p><a href="{{ url_for('logout') }}">Logout</a></p>
+"""
+
+
+##########
+# Helpers
+##########
+
+def flash_errors(form):
+    """Generate flashes form errors"""
+    for field, errors in form.errors.items():
+        for error in errors:
+            flash(u"Error in the %s field - %s" % (
+                getattr(form, field).label.text,
+                error
+            ), 'error')
+
+
+################################################################################################
+# configuration (Do NOT commit passwords/secrets. See skeleton example to handle them securely)
+################################################################################################
+
+class Config(object):
+    # sqlalchemy
+    SQLALCHEMY_DATABASE_URI = "sqlite:///temp.sqlite3"
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+    SECRET_KEY = "<my-secret-key>"
+    # write-behind
+    WRITE_BEHIND_ENABLED = True
+    WRITE_BEHIND_FLUSH_INTERVAL = 1.0
+    WRITE_BEHIND_MAX_PENDING = 1000
+
+
+#######################
+# application factory
+#######################
+
+def create_app(config=Config):
+    app = Flask(__name__)
+    app.config.from_object(config)
+
+    # initialize extensions
+    csrf.init_app(app)
+    login_manager.init_app(app)
+    login_manager.login_view = "login"
+    db.init_app(app)
+    write_behind.init_app(app)
+
+    with app.app_context():
+        db.create_all()
+
+        ##############
+        # Controllers
+        ##############
+
+        @login_manager.user_loader
+        def load_user(id):
+            return User.query.get(int(id))
+
+        @app.before_request
+        def track_last_seen():
+            """Queue 'last_seen_at' update for authenticated users"""
+            if current_user.is_authenticated:
+                write_behind.update(User, current_user.id, last_seen_at=datetime.utcnow())
+                if not write_behind.enabled:
+                    # queued updates need no commit. Commit would also expire 'current_user' and reload it
+                    db.session.commit()
+
+        @app.route("/register", endpoint="register", methods=["GET", "POST"])
+        def register():
+            """Handle register request"""
+            if current_user.is_authenticated:
+                return redirect(url_for('home'))
+            form = RegisterForm(request.form)
+            if request.method == "POST" and form.validate_on_submit():
+                password = generate_password_hash(form.password.data, method="sha256")
+                user = User(first_name=form.first_name.data, last_name=form.last_name.data, email=form.email.data,
+                            password=password)
+                db.session.add(user)
+                db.session.commit()
+                login_user(user)
+                app.logger.info("New user registered successfully using form | %s" % user.email)
+                return redirect(url_for("home"))
+            else:
+                flash_errors(form)
+            return render_template_string(register_template, form=form)
+
+        @app.route("/login", endpoint="login", methods=["GET", "POST"])
+        def login():
+            """Handle login request."""
+            if current_user.is_authenticated:
+                return redirect(url_for("home"))
+            form = LoginForm(request.form)
+            if request.method == "POST" and form.validate():
+                user = User.query.filter_by(email=form.email.data).first()
+                if user is None or not check_password_hash(user.password, form.password.data):
+                    flash("Invalid username/password")
+                    return render_template_string(login_template, form=form)
+                login_user(user)
+                write_behind.update(User, user.id, last_login_at=datetime.utcnow())
+                write_behind.increment(User, user.id, "login_count")
+                db.session.commit()
+                app.logger.debug("User login successful | %s" % user.email)
+                return redirect(url_for("home"))
+            else:
+                flash_errors(form)
+            return render_template_string(login_template, form=form)
+
+        @app.route("/logout", endpoint="logout")
+        @login_required
+        def logout():
+            """Handle logout request"""
+            logout_user()
+            return redirect(url_for("login"))
+
+        @app.route("/home", endpoint="home")
+        @app.route("/")
+        @login_required
+        def home():
+            """Home page view. Protected view"""
+            return render_template_string(home_template)
+
+        @app.route("/marketing", endpoint="marketing")
+        def marketing():
+            """Unprotected view"""
+            return "<h3> This is marketing page </h3>"
+
+    @app.cli.command("bench-write-behind")
+    @click.option("--requests", "count", default=2000, help="Number of authenticated requests per mode")
+    @click.option("--threads", default=8, help="Number of concurrent clients, each logged in as different user")
+    def bench_write_behind(count, threads):
+        """Compare authenticated request throughput with and without write-behind"""
+        import os
+        import tempfile
+        tmpdir = tempfile.mkdtemp()
+        click.echo("%-14s %12s %12s %14s %12s" % ("mode", "req/s", "UPDATEs", "rows/flush", "max lag(s)"))
+        for enabled in (False, True):
+            class BenchConfig(Config):
+                SQLALCHEMY_DATABASE_URI = "sqlite:///%s" % os.path.join(tmpdir, "bench-%s.sqlite3" % enabled)
+                WTF_CSRF_ENABLED = False
+                WRITE_BEHIND_ENABLED = enabled
+
+            bench_app = create_app(BenchConfig)
+            bench_queue = bench_app.extensions["write_behind"]
+            clients = []
+            for i in range(threads):
+                client = bench_app.test_client()
+                client.post("/register", data={"first_name": "first", "last_name": "last", "password": "password",
+                                               "email": "user%d@example.com" % i})
+                clients.append(client)
+            statements = [0]
+            engine = db.get_engine(bench_app)
+
+            def count_updates(conn, cursor, statement, parameters, context, executemany):
+                if statement.startswith("UPDATE"):
+                    statements[0] += 1
+            from sqlalchemy import event
+            event.listen(engine, "before_cursor_execute", count_updates)
+
+            def worker(client, n):
+                for _ in range(n):
+                    assert client.get("/home").status_code == 200
+
+            workers = [threading.Thread(target=worker, args=(client, count // threads)) for client in clients]
+            start = time.time()
+            for thread in workers:
+                thread.start()
+            for thread in workers:
+                thread.join()
+            elapsed = time.time() - start
+            bench_queue.stop()
+            event.remove(engine, "before_cursor_execute", count_updates)
+            stats = bench_queue.stats
+            click.echo("%-14s %12.1f %12d %14s %12s" % (
+                "write-behind" if enabled else "synchronous", (count // threads * threads) / elapsed, statements[0],
+                "%.1f" % (stats["flushed_rows"] / float(stats["flushes"])) if stats["flushes"] else "-",
+                "%.2f" % stats["max_lag"] if enabled else "-"))
+
+    return app
+
+
+if __name__ == "__main__":
+    app = create_app()
+    app.run()